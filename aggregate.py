@@ -0,0 +1,109 @@
+"""Contains functions to aggregate the survey responses for plotting."""
+import polars as pl
+from custom_logger import CustomLogger
+
+logger = CustomLogger(__name__)  # use custom logger
+
+# Categorical columns that are plotted as value counts
+CATEGORICAL_COLUMNS = [
+    'Gender',
+    'Age',
+    'Country',
+    'Micro-mobillity frequency',
+    'Bus frequency',
+    'Assistance feature valuable?',
+    'NFC feature valuable'
+]
+
+# Mapping of longer option names to shorter versions
+OPTION_MAPPING = {
+    "Safety information and protocols and emergency call option": "Safety information",
+}
+
+
+def count_values(df, columns=None):
+    """
+    Count the occurrences of each value for all categorical columns in one
+    pass. The queries of all columns are collected together, so polars scans
+    the frame once and runs the aggregations in parallel. Returns a count
+    table with the column name as key and a DataFrame with the values and
+    their count as value. The values are sorted, so the answers of the
+    ordinal (Enum) columns come out in their order.
+    """
+    if columns is None:
+        columns = CATEGORICAL_COLUMNS
+    lf = df.lazy()
+    queries = [value_counts(lf, col) for col in columns]
+    count_table = dict(zip(columns, pl.collect_all(queries)))
+    logger.info('Counted values of {} columns.', len(columns))
+    return count_table
+
+
+def value_counts(lf, column):
+    """Return a query that counts the occurrences of each value of column in the LazyFrame lf, sorted by value."""
+    return lf.group_by(column).agg(pl.count(column).alias('count')).sort(column)
+
+
+def get_counts(count_table, column):
+    """
+    Look up the counts of column in count_table. Returns a list with the
+    values and a list with their counts.
+    """
+    counts = count_table[column]
+    return counts[column].to_list(), counts['count'].to_list()
+
+
+def explode_options(series):
+    """
+    Split the comma-separated options in series into one row per chosen
+    option with whitespace stripped. Returns a DataFrame with the row of the
+    response in 'row' and the option in a column named like series. The
+    options are split after exploding, as evaluating an expression per list
+    is much slower on large columns.
+    """
+    return (series.str.split(',').to_frame().with_row_index('row').explode(series.name)
+            .drop_nulls(series.name).with_columns(pl.col(series.name).str.strip_chars()))
+
+
+def option_counts(lf, column):
+    """
+    Return a query that counts how often each option in the comma-separated
+    column of the LazyFrame lf is chosen, in lowercase like process_column.
+    The query can run with polars' streaming engine, as it only keeps the
+    counts of the options.
+    """
+    return (lf.select(pl.col(column).str.split(',')).explode(column).drop_nulls(column)
+            .select(pl.col(column).str.strip_chars().str.to_lowercase()).group_by(column)
+            .agg(pl.len().alias('count')))
+
+
+def process_column(data):
+    """
+    Count how often each option in the comma-separated column data is chosen.
+    Options are compared in lowercase. Returns a dictionary with the
+    percentage of participants choosing each option and a dictionary with
+    the counts of each option.
+    """
+    counts = explode_options(data).get_column(data.name).str.to_lowercase().value_counts()
+    option_counts = dict(zip(counts[data.name].to_list(), counts['count'].to_list()))
+    total_participants = len(data)
+    option_percentages = {option: (count / total_participants) * 100 for option, count in option_counts.items()}
+    return option_percentages, option_counts
+
+
+def process_options(series):
+    """
+    Parse the comma-separated column series into a list of options per
+    response. Options are capitalized and long option names are replaced
+    according to OPTION_MAPPING. Returns a polars Series of lists.
+    """
+    lists = (explode_options(series).with_columns(format_option(pl.col(series.name)))
+             .group_by('row', maintain_order=True).agg(series.name))
+    # one list per response, with null for responses without options
+    rows = pl.DataFrame({'row': pl.arange(0, len(series), eager=True, dtype=pl.UInt32)})
+    return rows.join(lists, on='row', how='left', coalesce=True).get_column(series.name)
+
+
+def format_option(option):
+    """Return an expression that capitalizes option and shortens it according to OPTION_MAPPING."""
+    return (option.str.slice(0, 1).str.to_uppercase() + option.str.slice(1).str.to_lowercase()).replace(OPTION_MAPPING)
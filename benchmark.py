@@ -0,0 +1,237 @@
+"""Contains benchmarks of the stages of the analysis."""
+import os
+import sys
+import glob
+import time
+import json
+import shutil
+import subprocess
+import argparse
+import tempfile
+import statistics
+import plotly.graph_objects as go
+import plotly.io as pio
+import aggregate
+import common
+import correlation
+import dataset
+import export
+import indicators
+import schema
+import synthetic
+from state import AggregateState
+from custom_logger import CustomLogger
+from logmod import logs
+
+logger = CustomLogger(__name__)  # use custom logger
+
+# Numbers of synthetic responses the stages are benchmarked on by default
+ROWS = [1000, 10000, 100000]
+
+# Memory budget in MB of the streaming aggregation
+STREAM_BUDGET_MB = 256
+
+# Relative slowdown against a baseline that is reported as a regression
+TOLERANCE = 0.2
+
+# Modules whose import time is measured, and packages that they should only import when a stage needs them
+IMPORT_MODULES = ['main', 'dataset', 'state', 'export']
+LAZY_PACKAGES = ['matplotlib', 'seaborn', 'sklearn', 'kaleido', 'pandas', 'scipy', 'plotly.express']
+
+
+def median_time(func, repeat=3):
+    """
+    Call func once to warm up (imports, caches) and then repeat times, and
+    return the median duration of a call in seconds.
+    """
+    func()
+    durations = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        durations.append(time.perf_counter() - start)
+    return statistics.median(durations)
+
+
+def renderer_latency(n_images=5):
+    """
+    Measure the latency per PNG image when the Kaleido renderer is started for
+    every figure and when one persistent renderer is reused. Returns a
+    dictionary with the median latency in seconds for both cases.
+    """
+    fig = json.loads(go.Figure(go.Bar(x=list(range(20)), y=list(range(20)))).to_json())
+    latencies = {'restarted': [], 'persistent': []}
+    for _ in range(n_images):
+        # shut the renderer down, so the next image pays the start-up again
+        pio.kaleido.scope._shutdown_kaleido()
+        start = time.perf_counter()
+        pio.to_image(fig, format='png', width=1600, height=900, scale=3, validate=False)
+        latencies['restarted'].append(time.perf_counter() - start)
+    export.start_renderer()
+    for _ in range(n_images):
+        start = time.perf_counter()
+        pio.to_image(fig, format='png', width=1600, height=900, scale=3, validate=False)
+        latencies['persistent'].append(time.perf_counter() - start)
+    return {case: statistics.median(values) for case, values in latencies.items()}
+
+
+def import_time(module):
+    """
+    Import module in a fresh interpreter with -X importtime. Returns the
+    cumulative import time in seconds and the packages of LAZY_PACKAGES
+    that were imported with it.
+    """
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import ' + module], cwd=common.root_dir,
+                            capture_output=True, text=True, check=True)
+    cumulative = {}
+    for line in result.stderr.splitlines():
+        # lines look like 'import time:       self [us] |  cumulative | imported package'
+        if line.startswith('import time:') and '|' in line and 'cumulative' not in line:
+            _, total, name = line.split('|')
+            cumulative[name.strip()] = int(total) / 1e6
+    return cumulative[module], [package for package in LAZY_PACKAGES if package in cumulative]
+
+
+def import_timings(repeat=3):
+    """
+    Measure the median import time of each module in IMPORT_MODULES in
+    seconds. Modules that import one of LAZY_PACKAGES are logged, as that
+    slows down the start of every run.
+    """
+    timings = {}
+    for module in IMPORT_MODULES:
+        runs = [import_time(module) for _ in range(repeat)]
+        timings['import_' + module] = statistics.median(seconds for seconds, _ in runs)
+        if runs[0][1]:
+            logger.warning('Importing {} also imports {}.', module, ', '.join(runs[0][1]))
+    return timings
+
+
+def stage_timings(path, repeat=3):
+    """
+    Time the stages of the analysis on the responses in the CSV file path,
+    from ingestion and parsing of the options to the correlation builders
+    and the streaming aggregation. The ingestion cache is written to a
+    temporary folder. Returns a dictionary with the median duration of each
+    stage in seconds.
+    """
+    cache_dir = common.cache_dir
+    common.cache_dir = tempfile.mkdtemp()
+    try:
+        def ingest():
+            for cached in glob.glob(os.path.join(common.cache_dir, '*.arrow')):
+                os.remove(cached)
+            dataset.ingest(path)
+
+        timings = {'ingest': median_time(ingest, repeat)}
+        timings['collect'] = median_time(lambda: dataset.prepare_data(path), repeat)
+        df = dataset.prepare_data(path)
+        column = df.get_column(indicators.INFORMATION_COLUMNS[0])
+        timings['count_values'] = median_time(lambda: aggregate.count_values(df, aggregate.CATEGORICAL_COLUMNS), repeat)
+        timings['process_column'] = median_time(lambda: aggregate.process_column(column), repeat)
+        timings['process_options'] = median_time(lambda: aggregate.process_options(column), repeat)
+        timings['encode_options'] = median_time(lambda: indicators.encode_options(df), repeat)
+        matrix = indicators.encode_options(df)
+        timings['co_occurrence'] = median_time(matrix.co_occurrence, repeat)
+        counts = matrix.co_occurrence()
+        # a new object per call, as the correlation matrix is cached
+        timings['corr'] = median_time(
+            lambda: correlation.CoOccurrence(counts.n, counts.options, counts.counts).corr(), repeat)
+        # a block of one column against the others, which is computed without the full matrix
+        rows, columns = indicators.INFORMATION_COLUMNS[:1], indicators.INFORMATION_COLUMNS[1:]
+        timings['corr_block'] = median_time(
+            lambda: correlation.CoOccurrence(counts.n, counts.options, counts.counts).corr(rows, columns), repeat)
+        timings['aggregate_state'] = median_time(lambda: AggregateState.from_frame(df), repeat)
+        timings['stream_state'] = median_time(lambda: dataset.stream_state(path, STREAM_BUDGET_MB), repeat)
+    finally:
+        shutil.rmtree(common.cache_dir, ignore_errors=True)
+        common.cache_dir = cache_dir
+    return timings
+
+
+def export_timings(repeat=3):
+    """
+    Time the export of a typical figure as HTML and as PNG with a persistent
+    renderer. The export does not depend on the number of responses. Returns
+    a dictionary with the median duration of each format in seconds.
+    """
+    fig_json = go.Figure(go.Pie(labels=schema.LIKERT_LEVELS, values=list(range(1, 6)))).to_json()
+    folder = tempfile.mkdtemp()
+    try:
+        export.start_renderer()
+        return {'export_' + file_format: median_time(
+            lambda: export.render(fig_json, os.path.join(folder, 'figure.' + file_format), file_format), repeat)
+            for file_format in export.FORMATS}
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+
+
+def run_suite(rows=None, repeat=3, seed=0):
+    """
+    Benchmark the stages on synthetic responses of each number of rows and
+    the export and import of modules. Returns a dictionary with the median
+    durations in seconds by number of rows ('export' for the export and
+    'import' for the imports).
+    """
+    results = {}
+    folder = tempfile.mkdtemp()
+    try:
+        for n in rows or ROWS:
+            path = synthetic.write(os.path.join(folder, 'responses_{}.csv'.format(n)), n, seed=seed)
+            results[str(n)] = stage_timings(path, repeat)
+            os.remove(path)
+            for stage, duration in results[str(n)].items():
+                logger.info('{} rows, {}: {:.4f} s.', n, stage, duration)
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+    results['export'] = export_timings(repeat)
+    results['import'] = import_timings(repeat)
+    for stage, duration in {**results['export'], **results['import']}.items():
+        logger.info('{}: {:.4f} s.', stage, duration)
+    return results
+
+
+def compare(results, baseline, tolerance=TOLERANCE):
+    """
+    Compare results with the results of an earlier run in baseline. Returns a
+    list of (rows, stage, ratio) of the stages that became more than
+    tolerance slower.
+    """
+    regressions = []
+    for rows, timings in results.items():
+        for stage, duration in timings.items():
+            before = baseline.get(rows, {}).get(stage)
+            if before and duration > before * (1 + tolerance):
+                regressions.append((rows, stage, duration / before))
+    return regressions
+
+
+if __name__ == "__main__":
+    logs(show_level='info', show_color=True)
+    parser = argparse.ArgumentParser(description='Benchmark the stages of the analysis on synthetic responses.')
+    parser.add_argument('--rows', default=','.join(str(n) for n in ROWS),
+                        help='comma-separated numbers of synthetic responses, up to e.g. 10000000 '
+                             '(default: %(default)s)')
+    parser.add_argument('--repeat', type=int, default=3, help='runs per stage (default: %(default)s)')
+    parser.add_argument('--output', default=os.path.join(common.output_dir, 'benchmark.json'),
+                        help='JSON file to write the results to (default: %(default)s)')
+    parser.add_argument('--baseline', help='JSON file with the results of an earlier run to check for regressions')
+    parser.add_argument('--renderer', action='store_true',
+                        help='also measure the latency of a restarted and a persistent Kaleido renderer')
+    args = parser.parse_args()
+
+    results = run_suite([int(n) for n in args.rows.split(',')], repeat=args.repeat)
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+    logger.info('Wrote benchmark results to {}.', args.output)
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f))
+        for rows, stage, ratio in regressions:
+            logger.warning('{} ({} rows) is {:.2f} times slower than the baseline.', stage, rows, ratio)
+        if not regressions:
+            logger.info('No stage is more than {:.0%} slower than the baseline.', TOLERANCE)
+    if args.renderer:
+        for case, latency in renderer_latency().items():
+            logger.info('Median latency per image with {} renderer: {:.3f} s.', case, latency)
@@ -0,0 +1,98 @@
+"""Contains functions to skip plots whose inputs, parameters and code did not change."""
+import os
+import json
+import hashlib
+import inspect
+import common
+import export
+import instrument
+from custom_logger import CustomLogger
+
+logger = CustomLogger(__name__)  # use custom logger
+
+# Manifest with the fingerprint and output files of each plot function
+manifest_file = os.path.join(common.cache_dir, 'plots_manifest.json')
+
+# Modules shared by all plot functions, whose code is part of every fingerprint
+SHARED_MODULES = ['aggregate.py', 'correlation.py', 'dataset.py', 'export.py', 'figures.py', 'indicators.py',
+                  'schema.py', 'specs.py', 'state.py']
+
+# Fingerprints of the plot functions that ran during this run, waiting for their export
+_pending = {}
+
+
+def reads(*columns):
+    """Decorator that records the columns of the prepared dataset read by a plot function."""
+    def decorator(func):
+        func.columns = list(columns)
+        return func
+    return decorator
+
+
+def code_version():
+    """Return a hash of the source code of the modules shared by all plot functions."""
+    h = hashlib.sha256()
+    for module in SHARED_MODULES:
+        with open(os.path.join(common.root_dir, module), 'rb') as f:
+            h.update(f.read())
+    return h.hexdigest()
+
+
+def fingerprint(state, func):
+    """
+    Return the fingerprint of plot function func. It combines the aggregates
+    in state of the columns read by func, the plot parameters from the config
+    file, the plot specification of func if it has one, the export formats and
+    the source code of func and the shared modules.
+    """
+    h = hashlib.sha256()
+    h.update(code_version().encode())
+    h.update(inspect.getsource(func).encode())
+    h.update(common.get_configs('plotly_template').encode())
+    h.update(json.dumps(getattr(func, 'spec', None), sort_keys=True).encode())
+    h.update(','.join(export.formats).encode())
+    h.update(state.digest(func.columns).encode())
+    return h.hexdigest()
+
+
+def load_manifest():
+    """Load the manifest of the previous runs. Returns an empty manifest if there is none."""
+    try:
+        with open(manifest_file) as f:
+            return json.load(f)
+    except (FileNotFoundError, json.decoder.JSONDecodeError):
+        return {}
+
+
+def run(func, state, *args, force=False):
+    """
+    Run plot function func with args, unless all its outputs exist and its
+    fingerprint on the aggregate state matches the one in the manifest. With force=True func
+    is always run. Returns True if func was run.
+    """
+    key = fingerprint(state, func)
+    entry = load_manifest().get(func.__name__)
+    up_to_date = entry is not None and entry['fingerprint'] == key and all(os.path.isfile(p) for p in entry['outputs'])
+    if up_to_date and not force:
+        logger.info('Skipped {}, its outputs are up to date.', func.__name__)
+        return False
+    with export.recording() as outputs, instrument.measure(func.__name__, 'figure'):
+        func(*args)
+    _pending[func.__name__] = (key, outputs)
+    return True
+
+
+def commit(failures):
+    """
+    Store the fingerprints of the plot functions run during this run in the
+    manifest, except for functions with an output in the failed exports.
+    """
+    failed = {name for name, _, _ in failures}
+    manifest = load_manifest()
+    for func_name, (key, outputs) in _pending.items():
+        if not any(os.path.splitext(os.path.basename(path))[0] in failed for path in outputs):
+            manifest[func_name] = {'fingerprint': key, 'outputs': outputs}
+    _pending.clear()
+    os.makedirs(common.cache_dir, exist_ok=True)
+    with open(manifest_file, 'w') as f:
+        json.dump(manifest, f, indent=2)
@@ -3,6 +3,11 @@ import os
 import json
 import pickle
 import sys
+import threading
+import dataclasses
+from types import MappingProxyType
+from collections.abc import Mapping
+from typing import Any, Optional, Tuple, Union
 from custom_logger import CustomLogger
 
 root_dir = os.path.dirname(__file__)
@@ -13,60 +18,182 @@ output_dir = os.path.join(root_dir, '_output')
 logger = CustomLogger(__name__)  # use custom logger
 
 
-def get_configs(entry_name: str, config_file_name: str = 'config', config_default_file_name: str = 'default.config'):
+# Prefix of the environment variables that override config entries, e.g. SHUTTLE_BOARDING_EXPORT_WORKERS=2
+ENV_PREFIX = 'SHUTTLE_BOARDING_'
+
+# Formats of the log output
+LOG_FORMATS = ('text', 'json')
+
+
+@dataclasses.dataclass(frozen=True)
+class Settings:
+    """Validated settings of the analysis, merged from default.config, the config file and the environment.
+
+    The object is immutable: lists in the config are stored as tuples and
+    dictionaries as read-only mappings. Call reload_settings to pick up
+    changes of the files or the environment.
+    """
+    data: Union[str, Tuple[str, ...]]
+    plotly_template: str
+    plots: str
+    export_workers: int
+    headless: bool
+    log_format: str
+    memory_budget_mb: Optional[int]
+    plot_specs: Tuple[Mapping[str, Any], ...]
+
+
+# Check of each entry of the settings and a description of the valid values
+_CHECKS = {
+    'data': (lambda v: isinstance(v, str) or (isinstance(v, tuple) and v and all(isinstance(p, str) for p in v)),
+             'a file name, a glob pattern or a list of these'),
+    'plotly_template': (lambda v: isinstance(v, str), 'the name of a plotly template'),
+    'plots': (lambda v: isinstance(v, str), 'a folder'),
+    'export_workers': (lambda v: isinstance(v, int) and not isinstance(v, bool) and v >= 1, 'a positive integer'),
+    'headless': (lambda v: isinstance(v, bool), 'true or false'),
+    'log_format': (lambda v: v in LOG_FORMATS, 'one of ' + ', '.join(LOG_FORMATS)),
+    'memory_budget_mb': (lambda v: v is None or (isinstance(v, int) and not isinstance(v, bool) and v >= 1),
+                         'null or a positive integer'),
+    'plot_specs': (lambda v: isinstance(v, tuple) and all(isinstance(spec, Mapping) for spec in v),
+                   'a list of plot specifications'),
+}
+
+# Settings loaded from the default config files, see settings()
+_settings = None
+_settings_lock = threading.Lock()
+
+
+def _freeze(value):
+    """Return value with its lists converted to tuples and its dictionaries to read-only mappings."""
+    if isinstance(value, dict):
+        return MappingProxyType({key: _freeze(item) for key, item in value.items()})
+    if isinstance(value, list):
+        return tuple(_freeze(item) for item in value)
+    return value
+
+
+def _thaw(value):
+    """Return a mutable copy of a frozen value, with lists and dictionaries as read from the config file."""
+    if isinstance(value, Mapping):
+        return {key: _thaw(item) for key, item in value.items()}
+    if isinstance(value, tuple):
+        return [_thaw(item) for item in value]
+    return value
+
+
+def _read_json(path):
+    """Read the JSON file path. Raises ValueError if it is badly formatted."""
+    with open(path) as f:
+        try:
+            return json.load(f)
+        except json.decoder.JSONDecodeError as e:
+            raise ValueError('Config file {} badly formatted: {}.'.format(path, e))
+
+
+def _merge_entries(config_file_name, config_default_file_name, environ):
     """
-    Open the config file and return the requested entry.
-    If no config file is found, open default.config.
+    Read default.config and the config file and apply the overrides from the
+    environment variables. Returns the entries and the warnings about them,
+    without logging the warnings.
     """
-    # check if config file is updated
-    if not check_config():
-        sys.exit()
+    if environ is None:
+        environ = os.environ
+    warnings = []
+    entries = _read_json(os.path.join(root_dir, config_default_file_name))
     try:
-        with open(os.path.join(root_dir, config_file_name)) as f:
-            content = json.load(f)
+        config = _read_json(os.path.join(root_dir, config_file_name))
     except FileNotFoundError:
-        with open(os.path.join(root_dir, config_default_file_name)) as f:
-            content = json.load(f)
-    return content[entry_name]
+        warnings.append('Config file {} not found, using {}.'.format(config_file_name, config_default_file_name))
+    else:
+        missing = [name for name in entries if name not in config]
+        if missing:
+            warnings.append('Config file {} does not set {}, using the values in {}.'.format(
+                config_file_name, ', '.join(missing), config_default_file_name))
+        entries.update(config)
+    for name in list(entries):
+        override = environ.get(ENV_PREFIX + name.upper())
+        if override is not None:
+            try:
+                entries[name] = json.loads(override)
+            except json.decoder.JSONDecodeError:
+                entries[name] = override
+    return entries, warnings
 
 
-def check_config(config_file_name: str = 'config',
-                 config_default_file_name: str = 'default.config'):
+def read_entry(entry_name: str, config_file_name: str = 'config', config_default_file_name: str = 'default.config',
+               environ=None):
     """
-    Check if config file has at least as many rows as default.config.
+    Return the value of a config entry as merged by load_settings, but
+    without validating the settings or logging warnings, or None if it is
+    not set. Used to set up logging before the settings are loaded.
     """
-    # load config file
     try:
-        with open(os.path.join(root_dir, config_file_name)) as f:
-            config = json.load(f)
-    except FileNotFoundError:
-        logger.error('Config file {} not found.', config_file_name)
-        return False
-    except json.decoder.JSONDecodeError:
-        logger.error('Config file badly formatted. Please update based on' +
-                     ' default.config.', config_file_name)
-        return False
-    # load default.config file
-    try:
-        with open(os.path.join(root_dir,
-                               config_default_file_name)) as f:
-            default = json.load(f)
-    except FileNotFoundError:
-        logger.error('Default config file {} not found.', config_file_name)
-        return False
-    except json.decoder.JSONDecodeError:
-        logger.error('Config file badly formatted. Please update based on' +
-                     ' default.config.', config_file_name)
-        return False
-    # check length of each file
-    if len(config) < len(default):
-        logger.error('Config file has {} variables, which is fewer than {} variables in default.config. Please'
-                     + ' update.',
-                     len(config),
-                     len(default))
-        return False
+        entries, _ = _merge_entries(config_file_name, config_default_file_name, environ)
+    except (ValueError, FileNotFoundError):
+        return None
+    return entries.get(entry_name)
+
+
+def load_settings(config_file_name: str = 'config', config_default_file_name: str = 'default.config',
+                  environ=None):
+    """
+    Read default.config and the config file, apply the overrides from the
+    environment variables (see ENV_PREFIX) and return the validated settings.
+    Entries missing in the config file take their value from default.config.
+    Override values are parsed as JSON if possible and used as text
+    otherwise. Raises ValueError if an entry is invalid.
+    """
+    entries, warnings = _merge_entries(config_file_name, config_default_file_name, environ)
+    for warning in warnings:
+        logger.warning('{}', warning)
+    fields = [field.name for field in dataclasses.fields(Settings)]
+    unknown = [name for name in entries if name not in fields]
+    if unknown:
+        logger.warning('Ignoring unknown config entries {}.', ', '.join(unknown))
+    values = {name: _freeze(entries.get(name)) for name in fields}
+    errors = ['{} must be {}, not {!r}'.format(name, _CHECKS[name][1], _thaw(value))
+              for name, value in values.items() if not _CHECKS[name][0](value)]
+    if errors:
+        raise ValueError('Invalid config: {}.'.format('; '.join(errors)))
+    return Settings(**values)
+
+
+def settings():
+    """
+    Return the settings of the analysis. They are loaded and validated on
+    the first call and shared afterwards. An invalid config is logged and
+    ends the program.
+    """
+    global _settings
+    with _settings_lock:
+        if _settings is None:
+            try:
+                _settings = load_settings()
+            except (ValueError, FileNotFoundError) as e:
+                logger.error('{}', e)
+                sys.exit(1)
+        return _settings
+
+
+def reload_settings():
+    """Load the settings again from the config files and the environment, and return them."""
+    global _settings
+    with _settings_lock:
+        _settings = None
+    return settings()
+
+
+def get_configs(entry_name: str, config_file_name: str = 'config', config_default_file_name: str = 'default.config'):
+    """
+    Return a copy of the requested entry of the settings (see settings()).
+    If no config file is found, default.config is used. The config files are
+    only read on the first call, unless other file names are given.
+    """
+    if (config_file_name, config_default_file_name) == ('config', 'default.config'):
+        value = getattr(settings(), entry_name)
     else:
-        return True
+        value = getattr(load_settings(config_file_name, config_default_file_name), entry_name)
+    return _thaw(value)
 
 
 def search_dict(dictionary, search_for, nested=False):
@@ -0,0 +1,141 @@
+"""Contains functions to compute correlations between binary indicators."""
+import numpy as np
+import instrument
+
+# Indicator matrices with a lower fraction of ones use sparse products
+SPARSE_DENSITY = 0.05
+
+
+def co_occurrence(values, sparse=None):
+    """
+    Compute the co-occurrence counts X.T @ X of the binary indicator matrix
+    values with a single matrix product. If sparse is None, sparse products
+    are used when the fraction of ones is below SPARSE_DENSITY.
+    """
+    if sparse is None:
+        sparse = values.size > 0 and np.count_nonzero(values) / values.size < SPARSE_DENSITY
+    if sparse:
+        from scipy import sparse as sp
+        x = sp.csc_matrix(values, dtype=np.float64)
+        return (x.T @ x).toarray()
+    x = values.astype(np.float64, copy=False)
+    return x.T @ x
+
+
+def phi_from_counts(n, co_counts, row_sums, col_sums):
+    """
+    Compute the phi (Pearson) coefficients of binary indicators from the
+    number of responses n, their co-occurrence counts and their column sums.
+    Indicators that are constant get a coefficient of NaN, like pandas.
+    """
+    row_sums = np.asarray(row_sums, dtype=np.float64)
+    col_sums = np.asarray(col_sums, dtype=np.float64)
+    numerator = n * co_counts - np.outer(row_sums, col_sums)
+    denominator = np.sqrt(np.outer(row_sums * (n - row_sums), col_sums * (n - col_sums)))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        phi = numerator / denominator
+    phi[denominator == 0] = np.nan
+    return np.clip(phi, -1, 1)
+
+
+class CorrelationMatrix:
+    """Correlation coefficients as NumPy array with the labels of its rows and columns.
+
+    Has the values, index and columns attributes of a pandas DataFrame, so
+    the plots can use it without pandas, which is an optional dependency.
+    """
+
+    def __init__(self, values, index, columns):
+        self.values = values
+        self.index = list(index)
+        self.columns = list(columns)
+
+    def to_pandas(self):
+        """Return the correlation matrix as pandas DataFrame. Needs pandas."""
+        import pandas as pd
+        return pd.DataFrame(self.values, index=self.index, columns=self.columns)
+
+
+class CoOccurrence:
+    """Co-occurrence counts of binary indicators, grouped by source column.
+
+    Holds the number of responses n, the options of each source column in
+    matrix order and the matrix counts with the number of responses choosing
+    each pair of options. The diagonal holds the number of responses
+    choosing each option. These statistics are enough to compute the phi
+    correlation and can be added up over batches of responses.
+    """
+
+    def __init__(self, n, options, counts):
+        self.n = n
+        self.options = options
+        self.counts = counts
+        self._correlation = None
+
+    @property
+    def labels(self):
+        """Labels of the indicators, as '<column>: <option>'."""
+        return [f"{col}: {opt}" for col, opts in self.options.items() for opt in opts]
+
+    def indices(self, columns):
+        """Return the indices of the indicators of the given source columns."""
+        starts = np.cumsum([0] + [len(opts) for opts in self.options.values()])
+        offsets = dict(zip(self.options, starts))
+        return np.array([i for col in columns for i in range(offsets[col], offsets[col] + len(self.options[col]))],
+                        dtype=int)
+
+    @instrument.timed('correlation')
+    def corr(self, rows=None, columns=None):
+        """
+        Return the phi (Pearson) correlation of the indicators as
+        CorrelationMatrix. If rows and columns are lists of source columns,
+        only that rectangular block is computed. The full matrix is computed
+        once and reused by later calls, also to look up blocks.
+        """
+        labels = self.labels
+        sums = np.diag(self.counts)
+        if rows is None and columns is None:
+            if self._correlation is None:
+                self._correlation = phi_from_counts(self.n, self.counts, sums, sums)
+            return CorrelationMatrix(self._correlation, labels, labels)
+        row_idx = np.arange(len(labels)) if rows is None else self.indices(rows)
+        col_idx = np.arange(len(labels)) if columns is None else self.indices(columns)
+        if self._correlation is not None:
+            values = self._correlation[np.ix_(row_idx, col_idx)]
+        else:
+            values = phi_from_counts(self.n, self.counts[np.ix_(row_idx, col_idx)], sums[row_idx], sums[col_idx])
+        return CorrelationMatrix(values, [labels[i] for i in row_idx], [labels[i] for i in col_idx])
+
+    def select(self, columns):
+        """Return the co-occurrence counts of the indicators of the given source columns."""
+        idx = self.indices(columns)
+        return CoOccurrence(self.n, {col: self.options[col] for col in columns}, self.counts[np.ix_(idx, idx)])
+
+    def merge(self, other):
+        """
+        Return the sum of the co-occurrence counts of two disjoint sets of
+        responses. Options that only occur in one of them are added with zero
+        counts for the other one.
+        """
+        options = {}
+        for col in list(self.options) + [col for col in other.options if col not in self.options]:
+            options[col] = sorted(set(self.options.get(col, [])) | set(other.options.get(col, [])))
+        merged = CoOccurrence(self.n + other.n, options, None)
+        labels = merged.labels
+        position = {label: i for i, label in enumerate(labels)}
+        counts = np.zeros((len(labels), len(labels)), dtype=np.int64)
+        for part in (self, other):
+            idx = np.array([position[label] for label in part.labels], dtype=int)
+            counts[np.ix_(idx, idx)] += part.counts
+        merged.counts = counts
+        return merged
+
+    def to_dict(self):
+        """Return the co-occurrence counts as a JSON-serializable dictionary."""
+        return {'n': self.n, 'options': self.options, 'counts': self.counts.tolist()}
+
+    @classmethod
+    def from_dict(cls, data):
+        """Create co-occurrence counts from a dictionary made by to_dict."""
+        counts = np.array(data['counts'], dtype=np.int64).reshape(-1, sum(len(o) for o in data['options'].values()))
+        return cls(data['n'], data['options'], counts)
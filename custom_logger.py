@@ -18,24 +18,44 @@ class CustomLogger:
 
     def __init__(self, name):
         self.logger = logging.getLogger(name)
-        self.logger.setLevel(5)
 
     def debug(self, msg, *args, **kwargs):
-        self.log(logging.DEBUG, msg, *args, **kwargs)
+        self._emit(logging.DEBUG, msg, args, kwargs)
 
     def info(self, msg, *args, **kwargs):
-        self.log(logging.INFO, msg, *args, **kwargs)
+        self._emit(logging.INFO, msg, args, kwargs)
 
     def warning(self, msg, *args, **kwargs):
-        self.log(logging.WARNING, msg, *args, **kwargs)
+        self._emit(logging.WARNING, msg, args, kwargs)
 
     def error(self, msg, *args, **kwargs):
-        self.log(logging.ERROR, msg, *args, **kwargs)
+        self._emit(logging.ERROR, msg, args, kwargs)
 
     def critical(self, msg, *args, **kwargs):
-        self.log(logging.CRITICAL, msg, *args, **kwargs)
+        self._emit(logging.CRITICAL, msg, args, kwargs)
 
     def log(self, level, msg, *args, **kwargs):
+        self._emit(level, msg, args, kwargs)
+
+    def _emit(self, level, msg, args, kwargs, stacklevel=3):
+        # The message is only formatted when a handler needs its text, so
+        # disabled levels cost one level check. stacklevel attributes the
+        # record to the caller of this class instead of this module.
         if self.logger.isEnabledFor(level):
-            msg = msg.format(*args)
-            self.logger._log(level, msg, args=(), **kwargs)
+            self.logger.log(level, BraceMessage(msg, args), stacklevel=stacklevel, **kwargs)
+
+
+class BraceMessage:
+    """Log message with str.format() style arguments that is formatted when it is first converted to text."""
+
+    __slots__ = ('msg', 'args', '_text')
+
+    def __init__(self, msg, args):
+        self.msg = msg
+        self.args = args
+        self._text = None
+
+    def __str__(self):
+        if self._text is None:
+            self._text = self.msg.format(*self.args)
+        return self._text
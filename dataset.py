@@ -0,0 +1,377 @@
+"""Contains functions to load and clean the survey responses."""
+import os
+import glob
+import json
+import hashlib
+import multiprocessing
+import polars as pl
+import aggregate
+import common
+import indicators
+import instrument
+import logmod
+import schema
+from concurrent.futures import ProcessPoolExecutor
+from state import AggregateState, count_co_occurrence, merge_states
+from custom_logger import CustomLogger
+
+logger = CustomLogger(__name__)  # use custom logger
+
+# Modules whose code determines the aggregate state
+STATE_MODULES = ['aggregate.py', 'correlation.py', 'dataset.py', 'indicators.py', 'schema.py', 'state.py']
+
+# Bytes read at a time when hashing a response file
+HASH_CHUNK_BYTES = 1 << 20
+
+# Columns read by clean
+CLEAN_COLUMNS = (['Have you read and understood the above instructions?', 'Consent to participate', 'Country']
+                 + list(schema.ORDINAL_COLUMNS))
+
+# Bytes read from the start of a response file to estimate the size of a row
+SAMPLE_BYTES = 1 << 20
+
+# Bytes of memory per byte of a CSV row while the streaming engine parses and processes it
+STREAM_OVERHEAD = 4
+
+# Fewest rows per chunk of the streaming engine and per batch of the co-occurrence counts
+MIN_CHUNK_ROWS = 1000
+
+
+def clean(lf):
+    """
+    Filter and normalize the responses in the LazyFrame lf. Responses of
+    participants who did not read the instructions or did not give consent
+    are dropped and variations of country names are replaced. The ordinal
+    columns are cast to their Enum types (see schema.cast), so an unknown
+    answer stops the run when the responses are loaded.
+    """
+    # Filter out the responses who haven't read the instruction or doesn't gave the consent
+    lf = lf.filter((pl.col("Have you read and understood the above instructions?") == "Yes")
+                   & (pl.col("Consent to participate") == "Yes"))
+
+    # Replace all variations of Netherlands, Germany and India to maintain consistency
+    lf = lf.with_columns(pl.col("Country")
+                         .str.replace_many(["NL", "The Netherlands", "netherlands", "Netherlands "], "Netherlands")
+                         .str.replace_many(["Germany "], "Germany")
+                         .str.replace_many(["India "], "India"))
+
+    # Store the ordinal answers in their order and reject unknown answers
+    return schema.cast(lf)
+
+
+def resolve_paths(data):
+    """
+    Return the sorted list of response files in data, which is a file name, a
+    glob pattern or a list of these.
+    """
+    paths = []
+    for pattern in ([data] if isinstance(data, str) else data):
+        matches = sorted(glob.glob(pattern))
+        if not matches:
+            raise FileNotFoundError('No response files match {}.'.format(pattern))
+        paths.extend(matches)
+    return paths
+
+
+def scan_responses(data, skip_rows=0):
+    """
+    Return a LazyFrame with the filtered and normalized responses in the CSV
+    file(s) data (see resolve_paths), skipping the first skip_rows rows of
+    each file. Multiple files are scanned in parallel
+    and unioned lazily: columns missing in a file are filled with nulls and
+    columns with different types are cast to a common type. The filter and
+    normalization are part of the same query, so polars pushes them down into
+    the scan of each file.
+    """
+    frames = [pl.scan_csv(path, skip_rows_after_header=skip_rows) for path in resolve_paths(data)]
+    lf = frames[0] if len(frames) == 1 else pl.concat(frames, how='diagonal_relaxed', parallel=True)
+    return clean(lf)
+
+
+def source_key(paths):
+    """Return a short hash of the absolute paths of the files paths, to tell datasets with equal file names apart."""
+    return hashlib.sha256('\n'.join(os.path.abspath(path) for path in paths).encode()).hexdigest()[:8]
+
+
+def file_hash(path):
+    """Return the SHA-256 hash of the contents of the file path."""
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def ingest(data):
+    """
+    Convert the responses in the CSV file(s) data to a filtered and normalized
+    Arrow IPC file in the cache folder and return its path. The file is keyed
+    by the hash of the CSV files and of the cleaning code, so it is only
+    written again when the responses or the cleaning change. The file name
+    starts with the name of the first file and a hash of the paths of the
+    files, so datasets do not replace each other's cache. Text columns that
+    are plotted as categories are stored dictionary-encoded, the ordinal
+    columns as Enum.
+    """
+    paths = resolve_paths(data)
+    prefix = os.path.splitext(os.path.basename(paths[0]))[0]
+    if len(paths) > 1:
+        prefix += '_{}_files'.format(len(paths))
+    prefix += '_' + source_key(paths)
+    key = hashlib.sha256(''.join([file_hash(path) for path in paths]
+                                 + [file_hash(__file__), file_hash(schema.__file__)]).encode()).hexdigest()
+    key = key[:16]
+    ipc_path = os.path.join(common.cache_dir, '{}_{}.arrow'.format(prefix, key))
+    if os.path.isfile(ipc_path):
+        return ipc_path
+    lf = scan_responses(paths)
+    types = lf.schema
+    lf = lf.with_columns(pl.col(col).cast(pl.Categorical) for col in aggregate.CATEGORICAL_COLUMNS
+                         if types.get(col) == pl.Utf8)
+    os.makedirs(common.cache_dir, exist_ok=True)
+    # write to a temporary file first, so an interrupted run does not leave a broken cache
+    # a global string cache lets the chunks read in parallel share their category encodings
+    with instrument.measure('scan_csv', 'scan'), pl.StringCache():
+        lf.collect().write_ipc(ipc_path + '.tmp', compression='uncompressed')
+    os.replace(ipc_path + '.tmp', ipc_path)
+    # remove the cached files of earlier versions of the same responses
+    pattern = '{}_{}.arrow'.format(glob.escape(prefix), '[0-9a-f]' * 16)
+    for old_path in glob.glob(os.path.join(common.cache_dir, pattern)):
+        if old_path != ipc_path:
+            os.remove(old_path)
+    logger.info('Ingested responses from {} into {}.', ', '.join(paths), ipc_path,
+                extra={'stage': 'ingest', 'path': ipc_path})
+    return ipc_path
+
+
+def prepare_data(data=None, columns=None):
+    """
+    Load the filtered and normalized responses in the CSV file(s) data as an
+    in-memory DataFrame, which is shared by all plot functions. The responses
+    are ingested into the Arrow IPC cache once and memory-mapped afterwards.
+    If columns is given, only these columns are read. If no data is given,
+    the data entry from the config file is used.
+    """
+    if data is None:
+        data = common.get_configs('data')
+    lf = pl.scan_ipc(ingest(data), memory_map=True)
+    if columns is not None:
+        lf = lf.select(columns)
+    with instrument.measure('collect', 'collect'):
+        df = lf.collect()
+    logger.info('Prepared dataset with {} responses from {}.', df.height, data,
+                extra={'stage': 'collect', 'rows': df.height, 'path': data})
+    return df
+
+
+def _prefix_hashes(path, size, prefix_size=None):
+    """
+    Return the SHA-256 hash of the first prefix_size bytes of the file path,
+    or None if no prefix_size is given or it exceeds size, and the hash of
+    the first size bytes. Both are computed in one pass over the file.
+    """
+    h = hashlib.sha256()
+    prefix = h.hexdigest() if prefix_size == 0 else None
+    read = 0
+    with open(path, 'rb') as f:
+        while read < size:
+            chunk = f.read(min(HASH_CHUNK_BYTES, size - read))
+            if not chunk:
+                break
+            if prefix_size is not None and read < prefix_size <= read + len(chunk):
+                # the hash of the prefix is taken where the previously read bytes end
+                h.update(chunk[:prefix_size - read])
+                prefix = h.hexdigest()
+                h.update(chunk[prefix_size - read:])
+            else:
+                h.update(chunk)
+            read += len(chunk)
+    return prefix, h.hexdigest()
+
+
+def update_state(data=None, memory_budget_mb=None):
+    """
+    Return the aggregate state of all responses in the CSV file(s) data,
+    updated incrementally. The state of each file and the number of rows read
+    are persisted in the cache folder. If a file only had rows appended since
+    the last run, only the new rows are read and aggregated; otherwise the
+    state of the file is computed from all rows. With a memory_budget_mb the
+    rows are streamed (see stream_state). If no data is given, the data entry
+    from the config file is used.
+    """
+    if data is None:
+        data = common.get_configs('data')
+    return merge_states([_update_file_state(path, memory_budget_mb) for path in resolve_paths(data)])
+
+
+def _update_file_state(path, memory_budget_mb=None):
+    """Return the aggregate state of the responses in the CSV file path, updated incrementally."""
+    prefix = os.path.splitext(os.path.basename(path))[0]
+    state_path = os.path.join(common.cache_dir, '{}_{}_state.json'.format(prefix, source_key([path])))
+    code = hashlib.sha256(''.join(file_hash(os.path.join(common.root_dir, module))
+                                  for module in STATE_MODULES).encode()).hexdigest()
+    size = os.path.getsize(path)
+    try:
+        with open(state_path) as f:
+            saved = json.load(f)
+    except (FileNotFoundError, json.decoder.JSONDecodeError):
+        saved = None
+    # hash the bytes read by the last run and the whole file in one pass, to detect any change of the read rows
+    read_hash, current_hash = _prefix_hashes(path, size, None if saved is None else saved['size'])
+    if (saved is not None and saved['source'] == os.path.abspath(path) and saved['code'] == code
+            and saved['size'] <= size and saved.get('hash') == read_hash):
+        state, rows = AggregateState.from_dict(saved['state']), saved['rows']
+    else:
+        state, rows = AggregateState(), 0
+    if size != (saved or {}).get('size') or rows == 0:
+        # read the rows appended since the last run
+        if memory_budget_mb is None:
+            delta = pl.read_csv(path, skip_rows_after_header=rows, schema=pl.scan_csv(path).schema)
+            new_rows = delta.height
+            state = state.merge(AggregateState.from_frame(clean(delta.lazy()).collect()))
+        else:
+            new_rows = pl.scan_csv(path, skip_rows_after_header=rows).select(pl.len()).collect(streaming=True).item()
+            state = state.merge(stream_state(path, memory_budget_mb, skip_rows=rows))
+        logger.info('Aggregated {} new rows of {}.', new_rows, path,
+                    extra={'stage': 'update_state', 'rows': new_rows, 'path': path})
+        rows += new_rows
+        os.makedirs(common.cache_dir, exist_ok=True)
+        with open(state_path, 'w') as f:
+            json.dump({'source': os.path.abspath(path), 'code': code, 'size': size, 'rows': rows,
+                       'hash': current_hash, 'state': state.to_dict()}, f)
+    logger.info('Prepared aggregate state with {} responses from {}.', state.n, path)
+    return state
+
+
+def row_bytes(paths):
+    """Return the size in bytes of a row of the CSV files paths, estimated from their first rows."""
+    sizes = []
+    for path in paths:
+        with open(path, 'rb') as f:
+            sample = f.read(SAMPLE_BYTES)
+        sizes.append(len(sample) / max(1, sample.count(b'\n')))
+    return max(sizes)
+
+
+def chunk_rows(memory_budget_mb, size):
+    """
+    Return the number of rows of size bytes per chunk of polars' streaming
+    engine, so that the chunks processed at the same time by all its threads
+    fit in memory_budget_mb.
+    """
+    return max(MIN_CHUNK_ROWS, int(memory_budget_mb * 2 ** 20 / (size * STREAM_OVERHEAD * pl.thread_pool_size())))
+
+
+def stream_state(data, memory_budget_mb, categorical_columns=None, option_columns=None, indicator_columns=None,
+                 skip_rows=0):
+    """
+    Compute the aggregate state of the filtered and normalized responses in
+    the CSV file(s) data in about memory_budget_mb of memory, without loading
+    the responses. The columns are chosen like in AggregateState.from_frame;
+    the first skip_rows rows of each file are skipped. The filter,
+    normalization, value counts and option counts run in polars' streaming
+    engine, in chunks sized to the budget. The co-occurrence counts are
+    computed in batches of rows read with polars' batched CSV reader and
+    merged. Only the aggregates are materialized.
+    """
+    if categorical_columns is None:
+        categorical_columns = aggregate.CATEGORICAL_COLUMNS
+    if option_columns is None:
+        option_columns = indicators.INFORMATION_COLUMNS
+    if indicator_columns is None:
+        indicator_columns = indicators.INFORMATION_COLUMNS
+    paths = resolve_paths(data)
+    size = row_bytes(paths)
+    lf = scan_responses(paths, skip_rows)
+    with pl.Config(streaming_chunk_size=chunk_rows(memory_budget_mb, size)), \
+            instrument.measure('stream_counts', 'aggregation'):
+        results = pl.collect_all([lf.select(pl.len())]
+                                 + [aggregate.value_counts(lf, col) for col in categorical_columns]
+                                 + [aggregate.option_counts(lf, col) for col in option_columns], streaming=True)
+    n = results[0].item()
+    categories = {col: dict(zip(counts[col].to_list(), counts['count'].to_list()))
+                  for col, counts in zip(categorical_columns, results[1:len(categorical_columns) + 1])}
+    options = {col: dict(zip(counts[col].to_list(), counts['count'].to_list()))
+               for col, counts in zip(option_columns, results[len(categorical_columns) + 1:])}
+    co_occurrence = None
+    if indicator_columns:
+        # a batch holds the parsed rows and their indicators, as uint8 and as float64 for the matrix product
+        indicators_per_row = sum(len(options.get(col, ())) for col in indicator_columns)
+        batch = max(MIN_CHUNK_ROWS, int(memory_budget_mb * 2 ** 20 / (size * STREAM_OVERHEAD
+                                                                      + 9 * max(1, indicators_per_row))))
+        # columns of all files with their common types, as in the union of scan_responses
+        union = pl.concat([pl.scan_csv(path) for path in paths], how='diagonal_relaxed').schema
+        needed = {col: dtype for col, dtype in union.items() if col in CLEAN_COLUMNS or col in indicator_columns}
+        for path in paths:
+            # read the columns used by the filter and normalization too, with the types of the full scan
+            types = pl.scan_csv(path).schema
+            columns = [col for col in types if col in needed]
+            reader = pl.read_csv_batched(path, columns=columns, schema_overrides=dict(types),
+                                         batch_size=batch, skip_rows_after_header=skip_rows)
+            while True:
+                batches = reader.next_batches(1)
+                if not batches:
+                    break
+                # columns missing in this file are null, and all columns get their common type
+                chunk = batches[0].lazy().with_columns(pl.col(col).cast(dtype) if col in types
+                                                       else pl.lit(None, dtype=dtype).alias(col)
+                                                       for col, dtype in needed.items())
+                part = count_co_occurrence(clean(chunk).select(indicator_columns).collect(), indicator_columns)
+                co_occurrence = part if co_occurrence is None else co_occurrence.merge(part)
+        if co_occurrence is None:
+            # files without rows
+            co_occurrence = count_co_occurrence(pl.DataFrame({col: [] for col in indicator_columns},
+                                                             schema={col: pl.Utf8 for col in indicator_columns}),
+                                                indicator_columns)
+    state = AggregateState(n, categories, options, co_occurrence)
+    logger.info('Streamed {} responses from {} within {} MB.', state.n, data, memory_budget_mb,
+                extra={'stage': 'stream_state', 'rows': state.n, 'path': data})
+    return state
+
+
+def aggregate_file(data, memory_budget_mb=None):
+    """
+    Return the aggregate state of the filtered and normalized responses in the
+    CSV file(s) data. With a memory_budget_mb the responses are streamed (see
+    stream_state).
+    """
+    if memory_budget_mb is not None:
+        return stream_state(data, memory_budget_mb)
+    state = AggregateState.from_frame(scan_responses(data).collect())
+    logger.info('Aggregated {} responses from {}.', state.n, data,
+                extra={'stage': 'aggregate_file', 'rows': state.n, 'path': data})
+    return state
+
+
+def _aggregate_shard(data, memory_budget_mb=None):
+    """
+    Return the aggregate state of the response file(s) data, made in a worker
+    process of aggregate_shards, and the timing records of the aggregation.
+    """
+    first = len(instrument.records())
+    state = aggregate_file(data, memory_budget_mb)
+    return state, instrument.records()[first:]
+
+
+def aggregate_shards(paths, workers=None, memory_budget_mb=None):
+    """
+    Aggregate the response files in paths, e.g. the files of different survey
+    waves or sites, each in its own process and merge their states. Only the
+    aggregate states are sent between the processes. workers is the number of
+    processes and defaults to the number of CPUs. With a memory_budget_mb
+    each process streams its file within an equal share of the budget. The
+    processes are spawned, as forking a process that uses polars' thread
+    pool can deadlock the child. Their log records go to the log of this
+    process and their timing records are added to the records of this
+    process.
+    """
+    workers = workers or os.cpu_count() or 1
+    share = None if memory_budget_mb is None else max(1, memory_budget_mb // min(workers, len(paths)))
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'),
+                             initializer=logmod.init_worker, initargs=logmod.worker_initargs()) as executor:
+        results = list(executor.map(_aggregate_shard, paths, [share] * len(paths)))
+    for _, records in results:
+        instrument.add_records(records)
+    state = merge_states([state for state, _ in results])
+    logger.info('Merged aggregate states of {} files with {} responses.', len(paths), state.n)
+    return state
@@ -0,0 +1,211 @@
+"""Contains functions to export the figures of the analysis in parallel."""
+import os
+import json
+import time
+import threading
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor
+import common
+import instrument
+from custom_logger import CustomLogger
+
+logger = CustomLogger(__name__)  # use custom logger
+
+# Formats the figures can be exported in
+FORMATS = ('png', 'html')
+
+# Formats the figures are exported in during this run
+formats = list(FORMATS)
+
+# Figures waiting to be exported, as (name, figure as JSON)
+_queue = []
+
+# Paths of all files queued or saved during this run
+_outputs = []
+
+# Lock of the queue and the outputs, as plot functions run in several threads
+_lock = threading.Lock()
+
+# Paths of the files queued or saved by each thread inside a recording block
+_recorded = threading.local()
+
+
+def set_formats(file_formats):
+    """Set the formats the figures are exported in during this run."""
+    unknown = [file_format for file_format in file_formats if file_format not in FORMATS]
+    if unknown:
+        raise ValueError('Unknown figure format(s): {}.'.format(', '.join(unknown)))
+    formats[:] = file_formats
+
+
+def save_figure(fig, name):
+    """
+    Queue the plotly figure fig for export in the selected formats with the
+    file name name in the plots folder. The figure is stored as JSON, so it can
+    be rendered in a worker process. Call flush to render the queue.
+    """
+    fig_json = fig.to_json()
+    plots_dir = common.get_configs('plots')
+    with _lock:
+        _queue.append((name, fig_json))
+    _add_outputs([os.path.join(plots_dir, name + '.' + file_format) for file_format in formats])
+
+
+def save_pyplot(name, dpi=300):
+    """
+    Save the current matplotlib figure as PNG with the file name name in the
+    plots folder. matplotlib figures are rendered directly, as they do not
+    need Kaleido. Nothing is saved if PNG is not a selected format.
+    """
+    import matplotlib.pyplot as plt
+    if 'png' not in formats:
+        plt.close()
+        return
+    os.makedirs(common.get_configs('plots'), exist_ok=True)
+    path = os.path.join(common.get_configs('plots'), name + '.png')
+    with instrument.measure(name, 'png'):
+        plt.savefig(path, dpi=dpi)
+    plt.close()
+    _add_outputs([path])
+
+
+def _add_outputs(paths):
+    """Add paths to the outputs of this run and to the recording of the current thread, if any."""
+    with _lock:
+        _outputs.extend(paths)
+    recorded = getattr(_recorded, 'paths', None)
+    if recorded is not None:
+        recorded.extend(paths)
+
+
+@contextmanager
+def recording():
+    """
+    Yield a list that collects the paths of the files queued or saved by the
+    current thread inside the block, e.g. by one plot function while other
+    plot functions run in other threads.
+    """
+    _recorded.paths = []
+    try:
+        yield _recorded.paths
+    finally:
+        _recorded.paths = None
+
+
+def outputs():
+    """Return the paths of all files queued or saved during this run."""
+    with _lock:
+        return list(_outputs)
+
+
+def start_renderer():
+    """
+    Start the Kaleido renderer of the current process by rendering an empty
+    figure. plotly keeps the renderer alive for the lifetime of the process,
+    so all figures rendered afterwards skip the Chromium start-up.
+    """
+    import plotly.io as pio
+    pio.to_image({'data': [], 'layout': {}}, format='png', width=10, height=10, validate=False)
+
+
+def render(fig_json, path, file_format):
+    """Render the figure stored as JSON to path in the given format ('png' or 'html')."""
+    import plotly.io as pio
+    # the figure was validated when it was built, so skip building it again
+    fig = json.loads(fig_json)
+    if file_format == 'png':
+        pio.write_image(fig, path, width=1600, height=900, scale=3, validate=False)
+    elif file_format == 'html':
+        pio.write_html(fig, file=path, auto_open=False, validate=False)
+    else:
+        raise ValueError('Unknown figure format: {}.'.format(file_format))
+    return path
+
+
+def _export_batch(batch, plots_dir, file_formats):
+    """
+    Render a batch of queued figures in file_formats with the renderer of
+    the current process. Returns (name, format, error) for each file, where error is None
+    on success, and the timing records of the exports.
+    """
+    results = []
+    first = len(instrument.records())
+    for name, fig_json in batch:
+        for file_format in file_formats:
+            try:
+                path = os.path.join(plots_dir, name + '.' + file_format)
+                start = time.perf_counter()
+                with instrument.measure(name, file_format):
+                    render(fig_json, path, file_format)
+                elapsed_ms = (time.perf_counter() - start) * 1000
+                logger.debug('Exported {} in {:.0f} ms.', path, elapsed_ms,
+                             extra={'stage': 'export_' + file_format, 'elapsed_ms': elapsed_ms, 'path': path})
+            except Exception as e:
+                results.append((name, file_format, '{}: {}'.format(type(e).__name__, e)))
+            else:
+                results.append((name, file_format, None))
+    return results, instrument.records()[first:]
+
+
+def flush(workers=None):
+    """
+    Render all queued figures in the selected formats. With more than one worker the
+    figures are split in one batch per worker and rendered in a process
+    pool, where each worker starts its Kaleido renderer once. A failing
+    figure is logged and does not stop the export of the other figures.
+    Returns a list of (name, format, error) tuples of the failed exports.
+    """
+    if workers is None:
+        workers = common.get_configs('export_workers')
+    plots_dir = common.get_configs('plots')
+    os.makedirs(plots_dir, exist_ok=True)
+    with _lock:
+        figures = list(_queue)
+        _queue.clear()
+    workers = max(1, min(workers, len(figures)))
+    if workers > 1:
+        results = []
+        batches = [figures[i::workers] for i in range(workers)]
+        initializer = start_renderer if 'png' in formats else None
+        with ProcessPoolExecutor(max_workers=workers, initializer=initializer) as executor:
+            futures = [executor.submit(_export_batch, batch, plots_dir, formats) for batch in batches]
+            for batch, future in zip(batches, futures):
+                try:
+                    batch_results, records = future.result()
+                    results.extend(batch_results)
+                    # the timings were measured in the worker process
+                    instrument.add_records(records)
+                except Exception as e:
+                    # the worker process itself failed, so the whole batch is lost
+                    results.extend((name, file_format, '{}: {}'.format(type(e).__name__, e))
+                                   for name, _ in batch for file_format in formats)
+    else:
+        results, _ = _export_batch(figures, plots_dir, formats)
+    failures = [result for result in results if result[2] is not None]
+    for name, file_format, error in failures:
+        logger.error('Failed to export {} as {}: {}', name, file_format, error)
+    logger.info('Exported {} of {} files with {} worker(s).', len(results) - len(failures), len(results), workers,
+                extra={'stage': 'export', 'files': len(results), 'failures': len(failures)})
+    return failures
+
+
+def write_index():
+    """
+    Write index.html in the plots folder with links to all HTML and PNG
+    figures in the folder. Returns the path of the index page.
+    """
+    plots_dir = common.get_configs('plots')
+    files = sorted(f for f in os.listdir(plots_dir) if f.endswith(('.html', '.png')) and f != 'index.html')
+    links = '\n'.join('<li><a href="{0}">{0}</a></li>'.format(f) for f in files)
+    path = os.path.join(plots_dir, 'index.html')
+    with open(path, 'w') as f:
+        f.write('<!DOCTYPE html>\n<html>\n<head><title>Shuttle bus survey</title></head>\n'
+                '<body>\n<h1>Shuttle bus survey</h1>\n<ul>\n{}\n</ul>\n</body>\n</html>\n'.format(links))
+    return path
+
+
+def open_index():
+    """Write the index page of the plots folder and open it in the browser."""
+    import webbrowser
+    path = write_index()
+    webbrowser.open('file://' + os.path.abspath(path))
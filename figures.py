@@ -0,0 +1,27 @@
+"""Contains helpers shared by the plot functions."""
+import plotly.graph_objects as go
+
+
+def shorten_label(label, col_mapping):
+    for long_col, short_col in col_mapping.items():
+        label = label.replace(long_col, short_col)
+    return label
+
+
+def correlation_heatmap(values, labels):
+    """
+    Return a heatmap of the correlation matrix values with labels on both
+    axes, laid out like plotly express' imshow. plotly express needs pandas,
+    which is optional, so the figure is built from graph objects.
+    """
+    from plotly.colors import sequential
+    fig = go.Figure(go.Heatmap(z=values, x=labels, y=labels, xaxis='x', yaxis='y', coloraxis='coloraxis', name='0',
+                               texttemplate='%{z:.4f}',
+                               hovertemplate='x: %{x}<br>y: %{y}<br>Correlation: %{z}<extra></extra>'))
+    fig.update_layout(
+        xaxis=dict(anchor='y', domain=[0.0, 1.0], scaleanchor='y', constrain='domain'),
+        yaxis=dict(anchor='x', domain=[0.0, 1.0], autorange='reversed', constrain='domain'),
+        coloraxis=dict(colorbar=dict(title=dict(text='Correlation')), colorscale=sequential.RdBu_r, cmin=-1, cmax=1),
+        margin=dict(t=60)
+    )
+    return fig
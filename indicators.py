@@ -0,0 +1,75 @@
+"""Contains functions to encode the multi-select survey questions as binary indicators."""
+import numpy as np
+import polars as pl
+import aggregate
+import correlation
+import instrument
+from custom_logger import CustomLogger
+
+logger = CustomLogger(__name__)  # use custom logger
+
+# Multi-select columns with the information required by participants
+INFORMATION_COLUMNS = [
+    'Information required preboarding (mobile screen)',
+    'Information required preboarding (public screen)',
+    'Information required onboarding (public screen)',
+    'Information required onboarding (private screen)',
+    'Information required onboarding (mobile screen)'
+]
+
+# Mapping of long column names to shorter labels
+COLUMN_LABELS = {
+    'Information required preboarding (mobile screen)': 'Pre-Mob',
+    'Information required preboarding (public screen)': 'Pre-Pub',
+    'Information required onboarding (public screen)': 'On-Pub',
+    'Information required onboarding (private screen)': 'On-Pvt',
+    'Information required onboarding (mobile screen)': 'On-Mob'
+}
+
+
+class IndicatorMatrix:
+    """Binary indicator matrix of the options chosen in multi-select columns.
+
+    The matrix is stored as a compact uint8 array with one row per response
+    and one column per option of each multi-select column. The column
+    metadata keeps the label of each indicator ('<column>: <option>') and
+    the range of indicators that belongs to each source column.
+    """
+
+    def __init__(self, values, labels, groups):
+        self.values = values
+        self.labels = labels
+        self.groups = groups
+
+    @instrument.timed('correlation')
+    def co_occurrence(self):
+        """Return the co-occurrence counts of the indicators, computed with one matrix product."""
+        options = {col: [label[len(col) + 2:] for label in self.labels[group]] for col, group in self.groups.items()}
+        counts = np.rint(correlation.co_occurrence(self.values)).astype(np.int64)
+        return correlation.CoOccurrence(self.values.shape[0], options, counts)
+
+
+@instrument.timed('binarization')
+def encode_options(df, columns=None):
+    """
+    Encode the comma-separated options of the multi-select columns of df as
+    one IndicatorMatrix. The options of each column are sorted in the same
+    way as sklearn's MultiLabelBinarizer. The matrix is meant to be built
+    once per run and shared by all plots that need it.
+    """
+    if columns is None:
+        columns = INFORMATION_COLUMNS
+    blocks, labels, groups = [], [], {}
+    for col in columns:
+        # Row of each chosen option and the position of the option in the sorted classes
+        chosen = aggregate.explode_options(df.get_column(col)).with_columns(aggregate.format_option(pl.col(col)))
+        classes = chosen.get_column(col).unique().sort()
+        positions = chosen.get_column(col).cast(pl.Enum(classes)).to_physical().to_numpy()
+        block = np.zeros((df.height, len(classes)), dtype=np.uint8)
+        block[chosen.get_column('row').to_numpy(), positions] = 1
+        blocks.append(block)
+        groups[col] = slice(len(labels), len(labels) + len(classes))
+        labels.extend(f"{col}: {opt}" for opt in classes.to_list())
+    values = np.concatenate(blocks, axis=1) if blocks else np.zeros((df.height, 0), dtype=np.uint8)
+    logger.info('Encoded {} options of {} columns.', len(labels), len(columns))
+    return IndicatorMatrix(values, labels, groups)
@@ -0,0 +1,144 @@
+"""Contains functions to record the wall time, CPU time and peak memory of the stages of the analysis."""
+import os
+import sys
+import csv
+import json
+import time
+import functools
+import threading
+from contextlib import contextmanager
+import common
+from custom_logger import CustomLogger
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+logger = CustomLogger(__name__)  # use custom logger
+
+# Fields of a record of a measured stage
+FIELDS = ['name', 'category', 'pid', 'thread', 'start', 'wall', 'cpu', 'peak_rss_mb', 'peak_rss_growth_mb']
+
+# Records of the stages measured during this run
+_records = []
+
+
+def peak_rss():
+    """Return the peak resident set size of the current process in MB, or None if it cannot be measured."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+    return peak / (1024 * 1024 if sys.platform == 'darwin' else 1024)
+
+
+@contextmanager
+def measure(name, category):
+    """
+    Record the block as stage name of category. The record holds the wall
+    time, the CPU time of the process, the peak RSS of the process at the end
+    of the block and how much the block raised it, all in seconds and MB.
+    The CPU time includes all threads of the process, such as polars' thread
+    pool, so blocks that run at the same time are each charged the CPU time
+    of all of them. It does not include other processes, such as the
+    Kaleido renderer.
+    """
+    start = time.time()
+    begin = time.perf_counter()
+    begin_cpu = time.process_time()
+    begin_rss = peak_rss()
+    try:
+        yield
+    finally:
+        end_rss = peak_rss()
+        _records.append({
+            'name': name,
+            'category': category,
+            'pid': os.getpid(),
+            'thread': threading.get_ident(),
+            'start': start,
+            'wall': time.perf_counter() - begin,
+            'cpu': time.process_time() - begin_cpu,
+            'peak_rss_mb': end_rss,
+            'peak_rss_growth_mb': end_rss - begin_rss if end_rss is not None else None,
+        })
+
+
+def timed(category):
+    """Decorator that records each call of the function as a stage of category, named after the function."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with measure(func.__name__, category):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def records():
+    """Return the records of the stages measured during this run."""
+    return list(_records)
+
+
+def add_records(new_records):
+    """Add the records measured in another process, e.g. an export worker."""
+    _records.extend(new_records)
+
+
+def summary():
+    """Return the total wall time, CPU time and number of records by category."""
+    totals = {}
+    for record in _records:
+        total = totals.setdefault(record['category'], {'wall': 0.0, 'cpu': 0.0, 'count': 0})
+        total['wall'] += record['wall']
+        total['cpu'] += record['cpu']
+        total['count'] += 1
+    return totals
+
+
+def write_report(folder=None):
+    """
+    Write the records of this run to timings.json and timings.csv in folder
+    (by default the output folder) and log the totals by category. Returns
+    the paths of both files.
+    """
+    if folder is None:
+        folder = common.output_dir
+    os.makedirs(folder, exist_ok=True)
+    json_path = os.path.join(folder, 'timings.json')
+    with open(json_path, 'w') as f:
+        json.dump({'records': _records, 'summary': summary()}, f, indent=2)
+    csv_path = os.path.join(folder, 'timings.csv')
+    with open(csv_path, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=FIELDS)
+        writer.writeheader()
+        writer.writerows(_records)
+    for category, total in sorted(summary().items(), key=lambda item: -item[1]['wall']):
+        logger.info('{}: {} stage(s), {:.2f} s wall time, {:.2f} s CPU time of the process.', category, total['count'],
+                    total['wall'], total['cpu'])
+    logger.info('Wrote timing report to {} and {}.', json_path, csv_path)
+    return json_path, csv_path
+
+
+def write_trace(path):
+    """
+    Write the records of this run as a Chrome trace to path, which can be
+    opened in chrome://tracing or Perfetto. Each process and thread gets its
+    own track.
+    """
+    origin = min((record['start'] for record in _records), default=0)
+    events = [{
+        'name': record['name'],
+        'cat': record['category'],
+        'ph': 'X',
+        'ts': (record['start'] - origin) * 1e6,
+        'dur': record['wall'] * 1e6,
+        'pid': record['pid'],
+        'tid': record['thread'],
+        'args': {'cpu': record['cpu'], 'peak_rss_mb': record['peak_rss_mb']},
+    } for record in _records]
+    with open(path, 'w') as f:
+        json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
+    logger.info('Wrote Chrome trace to {}.', path)
+    return path
@@ -1,10 +1,17 @@
 """Contain function to display or store logging messages."""
 import logging
+import logging.handlers
+import atexit
+import json
+import queue as queue_module
+import multiprocessing
 import sys
 import os
 import datetime as dt
+from collections.abc import Mapping
 from typing import Union, Optional
 import common
+from custom_logger import BraceMessage
 
 
 def logs(
@@ -14,7 +21,9 @@ def logs(
         path: Optional[str] = None,
         threads: bool = False,
         multiproc: bool = False,
-        show_color: bool = True
+        show_color: bool = True,
+        queue: bool = False,
+        json_lines: bool = False
 ) -> None:
     """
     Initialize the logger.
@@ -39,12 +48,26 @@ def logs(
     show_color : bool, default True
         If you have the coloredlogs package installed the messages will be
         colored.
+    queue : bool, default False
+        Hand the log records to a queue and write them to the console and the
+        file in a background thread, so logging does not block the calling
+        thread on I/O. With multiproc the queue is shared with the processes
+        forked by the program, whose records are written by the same thread.
+    json_lines : bool, default False
+        Write each record as one JSON object per line instead of a formatted
+        line, for log shippers. Fields passed with `extra`, such as stage,
+        elapsed_ms, rows and path, are included as keys. Colors are not used.
 
     Note that log levels can be one of the listed strings or an integer between
     1 and 100. If you want to get all possible log messages, use a log level of
     1.
     """
+    global _console_arguments
+    # spawned processes show their records like this process, see worker_initargs
+    _console_arguments = {'show_level': show_level, 'threads': threads, 'multiproc': multiproc,
+                          'show_color': show_color, 'json_lines': json_lines}
     logger_root = logging.getLogger()
+    _stop_listener()
     fmt_items = ('%(asctime)s',
                  '%(levelname)-8s',
                  '%(threadName)s' if threads else None,
@@ -52,11 +75,11 @@ def logs(
                  '%(name)s',
                  '%(message)s')
     fmt = ' - '.join((item for item in fmt_items if item is not None))
-    formatter = logging.Formatter(fmt)
+    formatter = JsonFormatter(threads, multiproc) if json_lines else logging.Formatter(fmt)
     logging.addLevelName(5, "VERBOSE")
     logger_root.setLevel(5)
 
-    if show_level and show_color:
+    if show_level and show_color and not json_lines:
         try:
             import coloredlogs
         except ImportError:
@@ -65,7 +88,7 @@ def logs(
             coloredlogs.install(fmt=fmt,
                                 level=_convert_logging_level(show_level),
                                 stream=sys.stdout)
-    if show_level and not show_color:
+    if show_level and (not show_color or json_lines):
         stream_handler = logging.StreamHandler()
         stream_handler.setLevel(_convert_logging_level(show_level))
         stream_handler.setFormatter(formatter)
@@ -82,9 +105,159 @@ def logs(
         file_handler.setFormatter(formatter)
         file_handler.setLevel(_convert_logging_level(save_level))
         logger_root.addHandler(file_handler)
+    levels = [_convert_logging_level(level) for level in (show_level, save_level) if level]
+    if levels:
+        # records below all handler levels are dropped before their message is formatted
+        logger_root.setLevel(min(levels))
+    if queue:
+        _start_listener(logger_root, multiproc)
     _logging_level_threshold()
 
 
+# Attributes of every log record, the other attributes of a record were passed with extra
+_RECORD_ATTRIBUTES = set(logging.makeLogRecord({}).__dict__) | {'message', 'asctime'}
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    Formatter that writes a record as one line of JSON with the time, level,
+    logger name and message, the thread and process name if requested, the
+    exception if any and the fields passed with extra.
+    """
+
+    def __init__(self, threads=False, multiproc=False):
+        super().__init__()
+        self.threads = threads
+        self.multiproc = multiproc
+
+    def format(self, record):
+        entry = {'time': dt.datetime.fromtimestamp(record.created, dt.timezone.utc).isoformat(),
+                 'level': record.levelname,
+                 'logger': record.name,
+                 'message': record.getMessage()}
+        if self.threads:
+            entry['thread'] = record.threadName
+        if self.multiproc:
+            entry['process'] = record.processName
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exception'] = record.exc_text
+        entry.update((key, value) for key, value in record.__dict__.items() if key not in _RECORD_ATTRIBUTES)
+        return json.dumps(entry, default=str)
+
+
+# Listener writing the queued log records, if logging through a queue, the process that started it and its queue
+_listener = None
+_listener_pid = None
+_listener_queue = None
+
+# Arguments of the last call of logs that determine how records are shown on the console
+_console_arguments = None
+
+
+# Types of message arguments that cannot change after the logging call
+IMMUTABLE_TYPES = (str, bytes, int, float, complex, bool, type(None))
+
+
+def _immutable(record):
+    """Return whether all message arguments of record are immutable, so it can be formatted later."""
+    args = record.msg.args if isinstance(record.msg, BraceMessage) else record.args
+    if isinstance(args, Mapping):
+        args = args.values()
+    return all(isinstance(arg, IMMUTABLE_TYPES) for arg in args or ())
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    """
+    Queue handler that leaves formatting to the listener. Records are reduced
+    to their message text when they are sent to other processes, as their
+    arguments may not be picklable, and when an argument is mutable, as it
+    may change before the listener formats the record.
+    """
+
+    def __init__(self, queue, multiproc):
+        super().__init__(queue)
+        self.multiproc = multiproc
+
+    def prepare(self, record):
+        if not self.multiproc and _immutable(record):
+            return record
+        record = logging.makeLogRecord(record.__dict__)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+def _start_listener(logger_root, multiproc):
+    """Move the handlers of logger_root to a listener thread and let logger_root queue its records instead."""
+    global _listener, _listener_pid, _listener_queue
+    handlers = list(logger_root.handlers)
+    for handler in handlers:
+        logger_root.removeHandler(handler)
+    # a multiprocessing queue is inherited by forked processes and can be passed to spawned ones (see init_worker)
+    # if it is made in the spawn context; a simple queue is faster within one process
+    record_queue = multiprocessing.get_context('spawn').Queue(-1) if multiproc else queue_module.SimpleQueue()
+    logger_root.addHandler(_QueueHandler(record_queue, multiproc))
+    _listener = logging.handlers.QueueListener(record_queue, *handlers, respect_handler_level=True)
+    _listener.start()
+    _listener_pid = os.getpid()
+    _listener_queue = record_queue if multiproc else None
+    # write the records still in the queue when the program ends, before multiprocessing closes the queue
+    atexit.unregister(_stop_listener)
+    atexit.register(_stop_listener)
+
+
+def _stop_listener():
+    """
+    Write the queued log records and stop the listener thread, if there is
+    one. Its handlers are given back to the root logger.
+    """
+    global _listener, _listener_queue
+    # forked processes inherit the listener, but its thread only runs in the process that started it
+    if _listener is not None and _listener_pid == os.getpid():
+        _listener.stop()
+        logger_root = logging.getLogger()
+        for handler in list(logger_root.handlers):
+            if isinstance(handler, _QueueHandler):
+                logger_root.removeHandler(handler)
+        # later records are written directly again
+        for handler in _listener.handlers:
+            logger_root.addHandler(handler)
+        _listener = None
+        _listener_queue = None
+
+
+def worker_initargs():
+    """
+    Return the arguments of init_worker for processes started with the spawn
+    method, which do not inherit the logging setup of this process.
+    """
+    return _listener_queue, logging.getLogger().level, _console_arguments
+
+
+def init_worker(record_queue, level, console_arguments):
+    """
+    Set up logging in a spawned process, as initializer of a process pool
+    with the initargs from worker_initargs. If the parent logs through a
+    multiprocessing queue, the records are sent to its listener, so they are
+    written to the same console and file in the same format. Otherwise they
+    are shown on the console like in the parent, but not saved to a file.
+    """
+    logger_root = logging.getLogger()
+    if record_queue is not None:
+        for handler in list(logger_root.handlers):
+            logger_root.removeHandler(handler)
+        logger_root.addHandler(_QueueHandler(record_queue, True))
+        logger_root.setLevel(level)
+        _logging_level_threshold()
+    elif console_arguments is not None:
+        logs(**console_arguments)
+
+
 def _logging_level_threshold():
     """
     Set the level threshold for a couple of internal and external modules.
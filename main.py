@@ -1,66 +1,66 @@
-import polars as pl
+import argparse
+import functools
+import importlib
+import importlib.util
 import numpy as np
-import os
 import plotly.graph_objects as go
-import plotly.io as pio
-import plotly.express as px
-from plotly.subplots import make_subplots
-import pandas as pd
-import seaborn as sns
-import matplotlib.pyplot as plt
-from sklearn.preprocessing import MultiLabelBinarizer
+import aggregate
+import cache
 import common
+import dataset
+import export
+import figures
+import indicators
+import instrument
+import pipeline
+import specs
+from state import AggregateState, count_categories, count_co_occurrence, count_options, merge_states
 from custom_logger import CustomLogger
 from logmod import logs
 
-logs(show_level='info', show_color=True)
 logger = CustomLogger(__name__)  # use custom logger
 
-# set template for plotly output
-template = common.get_configs('plotly_template')
 
+# Registry of plot functions by the name of their output, with the input they take
+PLOTS = {}
 
-# Function to process a column and calculate percentages and counts
-def process_column(data):
-    option_counts = {}
-    for row in data:
-        options = [option.strip().lower() for option in row.split(',')]
-        for option in options:
-            option_counts[option] = option_counts.get(option, 0) + 1
-    total_participants = len(data)
-    option_percentages = {option: (count / total_participants) * 100 for option, count in option_counts.items()}
-    return option_percentages, option_counts
+# Optional packages needed by plot functions, by the name of their output
+REQUIRES = {}
 
+# Names of the plot functions that draw with pyplot, whose global state lets only one of them run at a time
+PYPLOT = set()
 
-def process_options(series):
-    # Split the comma-separated values, strip whitespace, convert to lowercase, and capitalize first letter
-    options_list = series.map_elements(lambda x: [opt.strip().lower().capitalize() for opt in x.split(",")],
-                                       return_dtype=pl.List).to_list()
+# Names of the stages of the analysis other than the plots, which plots cannot be named after
+STAGES = ['frame', 'category_counts', 'option_counts', 'co_occurrence_counts', 'state', 'packages', 'count_table',
+          'option_table', 'co_occurrence', 'export']
 
-    # Define a mapping for longer option names to shorter versions
-    option_mapping = {
-        "Safety information and protocols and emergency call option": "Safety information",
-    }
 
-    # Apply the mapping and capitalize the first letter of each option
-    options_list = [[option_mapping.get(opt, opt).capitalize() for opt in sublist] for sublist in options_list]
+def register(name, data, requires=(), pyplot=False):
+    """
+    Decorator that registers a plot function under name. data is the input
+    the function takes: 'count_table', 'option_table' or 'co_occurrence'.
+    requires lists the optional packages the function imports. Functions
+    that draw with pyplot pass pyplot=True.
+    """
+    def decorator(func):
+        PLOTS[name] = (func, data)
+        REQUIRES[name] = list(requires)
+        if pyplot:
+            PYPLOT.add(name)
+        return func
+    return decorator
 
-    return options_list
 
+def missing_packages(name):
+    """Return the optional packages needed by plot name that are not installed."""
+    return [package for package in REQUIRES.get(name, []) if importlib.util.find_spec(package) is None]
 
-def shorten_label(label, col_mapping):
-    for long_col, short_col in col_mapping.items():
-        label = label.replace(long_col, short_col)
-    return label
 
-
-def gender_distribution_bar(df):
-    # Count the occurrences of each gender
-    gender_counts = df.group_by('Gender').agg(pl.count('Gender').alias('count')).collect()
-
-    # Extract data for plotting
-    genders = gender_counts['Gender'].to_list()
-    counts = gender_counts['count'].to_list()
+@register('gender_bar', 'count_table')
+@cache.reads('Gender')
+def gender_distribution_bar(count_table):
+    # Look up the occurrences of each gender
+    genders, counts = aggregate.get_counts(count_table, 'Gender')
 
     # Create the bar plot
     fig = go.Figure(data=[
@@ -75,20 +75,15 @@ def gender_distribution_bar(df):
         xaxis=dict(tickmode='array', tickvals=genders, ticktext=genders)
     )
 
-    # Save the figure in different formats
-    fig.write_image(os.path.join(common.get_configs('plots'), 'gender_bar.png'), width=1600, height=900, scale=3)
-
-    # Save plot as HTML
-    pio.write_html(fig, file=os.path.join(common.get_configs('plots'), 'gender_bar.html'), auto_open=True)
+    # Queue the figure for export as PNG and HTML
+    export.save_figure(fig, 'gender_bar')
 
 
-def gender_distribution_pie(df):
-    # Count the occurrences of each gender
-    gender_counts = df.group_by('Gender').agg(pl.count('Gender').alias('count')).collect()
-
-    # Extract data for plotting
-    genders = gender_counts['Gender'].to_list()
-    counts = gender_counts['count'].to_list()
+@register('gender_pie', 'count_table')
+@cache.reads('Gender')
+def gender_distribution_pie(count_table):
+    # Look up the occurrences of each gender
+    genders, counts = aggregate.get_counts(count_table, 'Gender')
 
     # Create the pie chart
     fig = go.Figure(data=[
@@ -101,20 +96,15 @@ def gender_distribution_pie(df):
         legend_title_text="Gender"
     )
 
-    # Save the figure in different formats
-    fig.write_image(os.path.join(common.get_configs('plots'), 'gender_pie.png'), width=1600, height=900, scale=3)
-
-    # Save plot as HTML
-    pio.write_html(fig, file=os.path.join(common.get_configs('plots'), 'gender_pie.html'), auto_open=True)
-
+    # Queue the figure for export as PNG and HTML
+    export.save_figure(fig, 'gender_pie')
 
-def age_distribution(df):
-    # Count the occurrences of each age
-    age_counts = df.group_by('Age').agg(pl.count('Age').alias('count')).collect()
 
-    # Extract data for plotting
-    age = age_counts['Age'].to_list()
-    counts = age_counts['count'].to_list()
+@register('age', 'count_table')
+@cache.reads('Age')
+def age_distribution(count_table):
+    # Look up the occurrences of each age
+    age, counts = aggregate.get_counts(count_table, 'Age')
 
     # Create the bar plot
     fig = go.Figure(data=[
@@ -129,20 +119,15 @@ def age_distribution(df):
         xaxis=dict(tickmode='array', tickvals=age, ticktext=age)
     )
 
-    # Save the figure in different formats
-    fig.write_image(os.path.join(common.get_configs('plots'), 'age.png'), width=1600, height=900, scale=3)
+    # Queue the figure for export as PNG and HTML
+    export.save_figure(fig, 'age')
 
-    # Save plot as HTML
-    pio.write_html(fig, file=os.path.join(common.get_configs('plots'), 'age.html'), auto_open=True)
 
-
-def demographic_distribution_bar(df):
-    # Group by country and count occurrences
-    country_counts = df.group_by('Country').agg(pl.count('Country').alias('count')).collect()
-
-    # Extract data for plotting
-    countries = country_counts['Country'].to_list()
-    counts = country_counts['count'].to_list()
+@register('country_bar', 'count_table')
+@cache.reads('Country')
+def demographic_distribution_bar(count_table):
+    # Look up the occurrences of each country
+    countries, counts = aggregate.get_counts(count_table, 'Country')
 
     # Define a list of colors
     colors = ['blue', 'green', 'red', 'purple', 'orange', 'cyan', 'magenta', 'yellow', 'brown', 'pink']
@@ -164,19 +149,15 @@ def demographic_distribution_bar(df):
         xaxis=dict(tickmode='array', tickvals=countries, ticktext=countries)
     )
 
-    # Save the figure in different formats
-    fig.write_image(os.path.join(common.get_configs('plots'), 'country_bar.png'), width=1600, height=900, scale=3)
-
-    # Save plot as HTML
-    pio.write_html(fig, file=os.path.join(common.get_configs('plots'), 'country_bar.html'), auto_open=True)
+    # Queue the figure for export as PNG and HTML
+    export.save_figure(fig, 'country_bar')
 
 
-def demographic_distribution_pie(df):
-    frequency_counts = df.group_by("Country").agg(pl.count(
-        'Country').alias('count')).collect()
-    # Extract data for plotting
-    frequency = frequency_counts['Country'].to_list()
-    counts = frequency_counts['count'].to_list()
+@register('country_pie', 'count_table')
+@cache.reads('Country')
+def demographic_distribution_pie(count_table):
+    # Look up the counts of each value
+    frequency, counts = aggregate.get_counts(count_table, 'Country')
 
     # Create the pie chart
     fig = go.Figure(data=[
@@ -189,227 +170,16 @@ def demographic_distribution_pie(df):
         legend_title_text="Country"
     )
 
-    # Save the figure in different formats
-    fig.write_image(os.path.join(common.get_configs('plots'), 'country_pie.png'), width=1600, height=900, scale=3)
-
-    # Save plot as HTML
-    pio.write_html(fig, file=os.path.join(common.get_configs('plots'), 'country_pie.html'), auto_open=True)
-
-
-def use_micro_mobility(df):
-    frequency_counts = df.group_by("Micro-mobillity frequency").agg(pl.count(
-        'Micro-mobillity frequency').alias('count')).collect()
-
-    # Extract data for plotting
-    frequency = frequency_counts['Micro-mobillity frequency'].to_list()
-    counts = frequency_counts['count'].to_list()
-
-    # Desired order of the legend items
-    desired_order = [
-        "Everyday",
-        "4 to 6 days a week",
-        "1 to 3 days a week",
-        "Once a month to once a week",
-        "Less than once a month",
-        "Never"
-    ]
-
-    # Ensure the desired order is respected
-    ordered_indices = [frequency.index(item) for item in desired_order if item in frequency]
-    ordered_frequency = [frequency[i] for i in ordered_indices]
-    ordered_counts = [counts[i] for i in ordered_indices]
-
-    # Create the pie chart
-    fig = go.Figure(data=[
-        go.Pie(labels=ordered_frequency, values=ordered_counts, hole=0.0,
-               pull=[0] * len(ordered_frequency), sort=False)])
-
-    # Update layout
-    fig.update_layout(
-        legend_title_text='Micro-mobility usage frequency',
-        legend=dict(itemsizing='constant', font=dict(size=12))
-    )
-
-    # Save the figure in different formats
-    fig.write_image(os.path.join(common.get_configs('plots'), 'micro-mobility.png'), width=1600, height=900, scale=3)
-
-    # Save plot as HTML
-    pio.write_html(fig, file=os.path.join(common.get_configs('plots'), 'micro-mobility.html'), auto_open=True)
-
-
-def use_bus(df):
-    frequency_counts = df.group_by("Bus frequency").agg(pl.count(
-        'Bus frequency').alias('count')).collect()
-
-    # Extract data for plotting
-    frequency = frequency_counts['Bus frequency'].to_list()
-    counts = frequency_counts['count'].to_list()
-
-    # Desired order of the legend items
-    desired_order = [
-        "0 times",
-        "1–2 times",
-        "3–4 times",
-        "5–6 times",
-        "7 or more times"
-    ]
-
-    # Ensure the desired order is respected
-    ordered_indices = [frequency.index(item) for item in desired_order if item in frequency]
-    ordered_frequency = [frequency[i] for i in ordered_indices]
-    ordered_counts = [counts[i] for i in ordered_indices]
-
-    # Create the pie chart
-    fig = go.Figure(data=[
-        go.Pie(labels=ordered_frequency, values=ordered_counts, hole=0.0,
-               pull=[0] * len(ordered_frequency), sort=False)])
-
-    # Update layout
-    fig.update_layout(
-        legend_title_text='Bus usage frequency (in weeks)',
-        legend=dict(itemsizing='constant', font=dict(size=12))
-    )
-
-    # Save the figure in different formats
-    fig.write_image(os.path.join(common.get_configs('plots'), 'bus_use.png'), width=1600, height=900, scale=3)
-
-    # Save plot as HTML
-    pio.write_html(fig, file=os.path.join(common.get_configs('plots'), 'bus_use.html'), auto_open=True)
-
-
-def viewing_assistance(df):
-    frequency_counts = df.group_by("Assistance feature valuable?").agg(pl.count(
-        'Assistance feature valuable?').alias('count')).collect()
-
-    # Extract data for plotting
-    frequency = frequency_counts['Assistance feature valuable?'].to_list()
-    counts = frequency_counts['count'].to_list()
-
-    # Desired order of the legend items
-    desired_order = [
-        "Strongly disagree",
-        "Disagree",
-        "Neither disagree nor agree",
-        "Agree",
-        "Strongly agree"
-    ]
-
-    # Ensure the desired order is respected and include zero counts for missing items
-    ordered_frequency = []
-    ordered_counts = []
-    for item in desired_order:
-        if item in frequency:
-            index = frequency.index(item)
-            ordered_frequency.append(frequency[index])
-            ordered_counts.append(counts[index])
-        else:
-            ordered_frequency.append(item)
-            ordered_counts.append(0)
-
-    # Create the pie chart
-    fig = go.Figure(data=[
-        go.Pie(
-            labels=ordered_frequency,
-            values=ordered_counts,
-            hole=0.0,
-            pull=[0] * len(ordered_frequency),
-            sort=False,
-            textinfo='percent',
-            insidetextorientation='horizontal',
-            hoverinfo='label+percent'
-        )
-    ])
-
-    # Update layout
-    fig.update_layout(
-        legend_title_text='Viewing assistance necessity',
-        legend=dict(itemsizing='constant', font=dict(size=12))
-    )
-
-    # Customizing the text to hide 0% labels
-    fig.update_traces(texttemplate=[
-        f'{percent:.2f}%' if percent > 0 else ''
-        for label, percent in zip(ordered_frequency, [c / sum(ordered_counts) * 100 for c in ordered_counts])
-    ])
+    # Queue the figure for export as PNG and HTML
+    export.save_figure(fig, 'country_pie')
 
-    # Save the figure in different formats
-    fig.write_image(os.path.join(common.get_configs('plots'), 'viewing_assistance.png'),
-                    width=1600, height=900, scale=3)
-
-    # Save plot as HTML
-    pio.write_html(fig, file=os.path.join(common.get_configs('plots'), 'viewing_assistance.html'), auto_open=True)
-
-
-def NFC(df):
-    frequency_counts = df.group_by("NFC feature valuable").agg(pl.count(
-        'NFC feature valuable').alias('count')).collect()
-
-    # Extract data for plotting
-    frequency = frequency_counts['NFC feature valuable'].to_list()
-    counts = frequency_counts['count'].to_list()
-
-    # Desired order of the legend items
-    desired_order = [
-        "Strongly disagree",
-        "Disagree",
-        "Neither disagree nor agree",
-        "Agree",
-        "Strongly agree"
-    ]
-
-    # Ensure the desired order is respected and include zero counts for missing items
-    ordered_frequency = []
-    ordered_counts = []
-    for item in desired_order:
-        if item in frequency:
-            index = frequency.index(item)
-            ordered_frequency.append(frequency[index])
-            ordered_counts.append(counts[index])
-        else:
-            ordered_frequency.append(item)
-            ordered_counts.append(0)
 
-    # Create the pie chart
-    fig = go.Figure(data=[
-        go.Pie(
-            labels=ordered_frequency,
-            values=ordered_counts,
-            hole=0.0,
-            pull=[0] * len(ordered_frequency),
-            sort=False,
-            textinfo='percent',
-            insidetextorientation='horizontal',
-            hoverinfo='label+percent'
-        )
-    ])
-
-    # Update layout
-    fig.update_layout(
-        legend_title_text='NFC necessity',
-        legend=dict(itemsizing='constant', font=dict(size=12))
-    )
-
-    # Customizing the text to hide 0% labels
-    fig.update_traces(texttemplate=[
-        f'{percent:.2f}%' if percent > 0 else ''
-        for label, percent in zip(ordered_frequency, [c / sum(ordered_counts) * 100 for c in ordered_counts])
-    ])
-
-    # Save the figure in different formats
-    fig.write_image(os.path.join(common.get_configs('plots'), 'NFC.png'),
-                    width=1600, height=900, scale=3)
-
-    # Save plot as HTML
-    pio.write_html(fig, file=os.path.join(common.get_configs('plots'), 'NFC.html'), auto_open=True)
-
-
-def info_preboarding(df):
-    # Extract and process data from both columns
-    column_10_data = df.select('Information required preboarding (mobile screen)').collect().to_series()
-    column_11_data = df.select('Information required preboarding (public screen)').collect().to_series()
-
-    percentages_10, counts_10 = process_column(column_10_data)
-    percentages_11, counts_11 = process_column(column_11_data)
+@register('info_mobile_pre', 'option_table')
+@cache.reads('Information required preboarding (mobile screen)', 'Information required preboarding (public screen)')
+def info_preboarding(option_table):
+    # Look up the processed options of both columns
+    percentages_10, counts_10 = option_table['Information required preboarding (mobile screen)']
+    percentages_11, counts_11 = option_table['Information required preboarding (public screen)']
 
     # Get a sorted list of unique options from both columns
     unique_options = sorted(set(percentages_10.keys()).union(set(percentages_11.keys())))
@@ -478,24 +248,18 @@ def info_preboarding(df):
 
     fig.update_layout(annotations=annotations)
 
-    # Save the figure in different formats
-    fig.write_image(os.path.join(common.get_configs('plots'), 'info_mobile_pre.png'),
-                    width=1600, height=900, scale=3)
-
-    # Save plot as HTML
-    pio.write_html(fig, file=os.path.join(common.get_configs('plots'), 'info_mobile_pre.html'), auto_open=True)
+    # Queue the figure for export as PNG and HTML
+    export.save_figure(fig, 'info_mobile_pre')
 
 
-def info_onboarding(df):
-    # Extract and process data from both columns
-    column_10_data = df.select('Information required onboarding (public screen)').collect().to_series()
-    column_11_data = df.select('Information required onboarding (private screen)').collect().to_series()
-    column_12_data = df.select('Information required onboarding (mobile screen)').collect().to_series()
-
-    # Process options
-    percentages_10, counts_10 = process_column(column_10_data)
-    percentages_11, counts_11 = process_column(column_11_data)
-    percentages_12, counts_12 = process_column(column_12_data)
+@register('info_onboard', 'option_table')
+@cache.reads('Information required onboarding (public screen)', 'Information required onboarding (private screen)',
+             'Information required onboarding (mobile screen)')
+def info_onboarding(option_table):
+    # Look up the processed options of all three columns
+    percentages_10, counts_10 = option_table['Information required onboarding (public screen)']
+    percentages_11, counts_11 = option_table['Information required onboarding (private screen)']
+    percentages_12, counts_12 = option_table['Information required onboarding (mobile screen)']
 
     # Get a sorted list of unique options from both columns
     unique_options = sorted(set(percentages_10.keys()).union(
@@ -583,62 +347,21 @@ def info_onboarding(df):
 
     fig.update_layout(annotations=annotations)
 
-    # Save the figure in different formats
-    fig.write_image(os.path.join(common.get_configs('plots'), 'info_onboard.png'),
-                    width=1600, height=900, scale=3)
-
-    # Save plot as HTML
-    pio.write_html(fig, file=os.path.join(common.get_configs('plots'), 'info_onboard.html'), auto_open=True)
-
-
-def create_combined_correlation_matrix(df):
-    columns = [
-        'Information required preboarding (mobile screen)',
-        'Information required preboarding (public screen)',
-        'Information required onboarding (public screen)',
-        'Information required onboarding (private screen)',
-        'Information required onboarding (mobile screen)'
-    ]
-
-    # Mapping of long column names to shorter labels
-    col_mapping = {
-        'Information required preboarding (mobile screen)': 'Pre-Mob',
-        'Information required preboarding (public screen)': 'Pre-Pub',
-        'Information required onboarding (public screen)': 'On-Pub',
-        'Information required onboarding (private screen)': 'On-Pvt',
-        'Information required onboarding (mobile screen)': 'On-Mob'
-    }
-
-    all_binary_matrices = []
-    all_column_labels = []
-
-    for col in columns:
-        column_data = df.select(col).collect().to_series()
-        options = process_options(column_data)
-        mlb = MultiLabelBinarizer()
-        binary_matrix = pd.DataFrame(mlb.fit_transform(options), columns=[f"{col}: {opt}" for opt in mlb.classes_],
-                                     dtype=int)
-        all_binary_matrices.append(binary_matrix)
-        all_column_labels.extend(binary_matrix.columns)
-
-    # Combine all binary matrices
-    combined_matrix = pd.concat(all_binary_matrices, axis=1)
-    combined_matrix = combined_matrix.loc[:, ~combined_matrix.columns.duplicated()]
+    # Queue the figure for export as PNG and HTML
+    export.save_figure(fig, 'info_onboard')
+
 
+@register('combined_correlation_matrix', 'co_occurrence')
+@cache.reads(*indicators.INFORMATION_COLUMNS)
+def create_combined_correlation_matrix(co_occurrence):
     # Calculate pairwise correlation
-    correlation_matrix = combined_matrix.corr()
+    correlation_matrix = co_occurrence.corr()
 
     # Shorten the labels for better readability
-    shortened_labels = [shorten_label(label, col_mapping) for label in correlation_matrix.columns]
+    shortened_labels = [figures.shorten_label(label, indicators.COLUMN_LABELS) for label in correlation_matrix.columns]
 
     # Create the correlation matrix heatmap
-    fig = px.imshow(correlation_matrix,
-                    labels=dict(color="Correlation"),
-                    x=shortened_labels,
-                    y=shortened_labels,
-                    color_continuous_scale='RdBu_r',
-                    zmin=-1, zmax=1,
-                    text_auto='.4f')
+    fig = figures.correlation_heatmap(correlation_matrix.values, shortened_labels)
 
     # Update layout for better readability
     fig.update_layout(
@@ -650,64 +373,30 @@ def create_combined_correlation_matrix(df):
         xaxis=dict(tickangle=45, tickfont=dict(size=8)),  # Reduce the font size of x-axis labels
         yaxis=dict(tickfont=dict(size=8))  # Reduce the font size of y-axis labels
     )
-    # Save the figure in different formats
-    fig.write_image(os.path.join(common.get_configs('plots'), 'combined_correlation_matrix.png'),
-                    width=1600, height=900, scale=3)
-
-    # Save plot as HTML
-    pio.write_html(fig, file=os.path.join(common.get_configs('plots'), 'combined_correlation_matrix.html'),
-                   auto_open=True)
-
-
-def create_combined_correlation_matrix_triangle(df):
-    columns = [
-        'Information required preboarding (mobile screen)',
-        'Information required preboarding (public screen)',
-        'Information required onboarding (public screen)',
-        'Information required onboarding (private screen)',
-        'Information required onboarding (mobile screen)'
-    ]
-
-    # Mapping of long column names to shorter labels
-    col_mapping = {
-        'Information required preboarding (mobile screen)': 'Pre-Mob',
-        'Information required preboarding (public screen)': 'Pre-Pub',
-        'Information required onboarding (public screen)': 'On-Pub',
-        'Information required onboarding (private screen)': 'On-Pvt',
-        'Information required onboarding (mobile screen)': 'On-Mob'
-    }
-
-    all_binary_matrices = []
-    all_column_labels = []
-
-    for col in columns:
-        column_data = df.select(col).collect().to_series()
-        options = process_options(column_data)
-        mlb = MultiLabelBinarizer()
-        binary_matrix = pd.DataFrame(mlb.fit_transform(options), columns=[f"{col}: {opt}" for opt in mlb.classes_],
-                                     dtype=int)
-        all_binary_matrices.append(binary_matrix)
-        all_column_labels.extend(binary_matrix.columns)
-
-    # Combine all binary matrices
-    combined_matrix = pd.concat(all_binary_matrices, axis=1)
-    combined_matrix = combined_matrix.loc[:, ~combined_matrix.columns.duplicated()]
+    # Queue the figure for export as PNG and HTML
+    export.save_figure(fig, 'combined_correlation_matrix')
+
 
+@register('combined_correlation_matrix_lower_triangle', 'co_occurrence', requires=['seaborn', 'pandas'], pyplot=True)
+@cache.reads(*indicators.INFORMATION_COLUMNS)
+def create_combined_correlation_matrix_triangle(co_occurrence):
+    # seaborn and matplotlib take long to import, so they are only imported when this plot is made
+    import seaborn as sns
+    import matplotlib.pyplot as plt
     # Calculate pairwise correlation
-    correlation_matrix = combined_matrix.corr()
+    correlation_matrix = co_occurrence.corr()
 
     # Shorten the labels for better readability
-    shortened_labels = [shorten_label(label, col_mapping) for label in correlation_matrix.columns]
-    correlation_matrix.columns = shortened_labels
-    correlation_matrix.index = shortened_labels
+    shortened_labels = [figures.shorten_label(label, indicators.COLUMN_LABELS) for label in correlation_matrix.columns]
 
     # Mask the upper triangle
-    mask = np.triu(np.ones_like(correlation_matrix, dtype=bool))
+    mask = np.triu(np.ones_like(correlation_matrix.values, dtype=bool))
 
     # Create the correlation matrix heatmap using seaborn
     plt.figure(figsize=(16, 12))
-    sns.heatmap(correlation_matrix, mask=mask, annot=True, fmt=".2f", annot_kws={"size": 6}, cmap='RdBu_r',
-                vmin=-1, vmax=1, linewidths=.5, cbar_kws={"shrink": .5})
+    sns.heatmap(correlation_matrix.values, mask=mask, xticklabels=shortened_labels, yticklabels=shortened_labels,
+                annot=True, fmt=".2f", annot_kws={"size": 6}, cmap='RdBu_r', vmin=-1, vmax=1, linewidths=.5,
+                cbar_kws={"shrink": .5})
 
     # plt.title('Lower Triangular Correlation Matrix of Information Required Preboarding and Onboarding', size=15)
     plt.xticks(rotation=45, ha='right', fontsize=8)
@@ -715,64 +404,26 @@ def create_combined_correlation_matrix_triangle(df):
     plt.tight_layout()
 
     # Save the figure
-    plt.savefig(os.path.join(common.get_configs('plots'), 'combined_correlation_matrix_lower_triangle.png'), dpi=300)
-    plt.show()
-
-
-def create_combined_correlation_matrix_triangle_plotly(df):
-    columns = [
-        'Information required preboarding (mobile screen)',
-        'Information required preboarding (public screen)',
-        'Information required onboarding (public screen)',
-        'Information required onboarding (private screen)',
-        'Information required onboarding (mobile screen)'
-    ]
-
-    # Mapping of long column names to shorter labels
-    col_mapping = {
-        'Information required preboarding (mobile screen)': 'Pre-Mob',
-        'Information required preboarding (public screen)': 'Pre-Pub',
-        'Information required onboarding (public screen)': 'On-Pub',
-        'Information required onboarding (private screen)': 'On-Pvt',
-        'Information required onboarding (mobile screen)': 'On-Mob'
-    }
-
-    all_binary_matrices = []
-    all_column_labels = []
-
-    for col in columns:
-        column_data = df.select(col).collect().to_series()
-        options = process_options(column_data)
-        mlb = MultiLabelBinarizer()
-        binary_matrix = pd.DataFrame(mlb.fit_transform(options), columns=[f"{col}: {opt}" for opt in mlb.classes_],
-                                     dtype=int)
-        all_binary_matrices.append(binary_matrix)
-        all_column_labels.extend(binary_matrix.columns)
-
-    # Combine all binary matrices
-    combined_matrix = pd.concat(all_binary_matrices, axis=1)
-    combined_matrix = combined_matrix.loc[:, ~combined_matrix.columns.duplicated()]
+    export.save_pyplot('combined_correlation_matrix_lower_triangle', dpi=300)
 
+
+@register('combined_correlation_matrix_lower_triangle_plotly', 'co_occurrence')
+@cache.reads(*indicators.INFORMATION_COLUMNS)
+def create_combined_correlation_matrix_triangle_plotly(co_occurrence):
     # Calculate pairwise correlation
-    correlation_matrix = combined_matrix.corr()
+    correlation_matrix = co_occurrence.corr()
 
     # Shorten the labels for better readability
-    shortened_labels = [shorten_label(label, col_mapping) for label in correlation_matrix.columns]
+    shortened_labels = [figures.shorten_label(label, indicators.COLUMN_LABELS) for label in correlation_matrix.columns]
 
     # Mask the upper triangle
-    mask = np.triu(np.ones_like(correlation_matrix, dtype=bool))
+    mask = np.triu(np.ones_like(correlation_matrix.values, dtype=bool))
 
     # Apply the mask to the correlation matrix
-    correlation_matrix_masked = correlation_matrix.mask(mask)
+    correlation_matrix_masked = np.where(mask, np.nan, correlation_matrix.values)
 
     # Create the correlation matrix heatmap
-    fig = px.imshow(correlation_matrix_masked,
-                    labels=dict(color="Correlation"),
-                    x=shortened_labels,
-                    y=shortened_labels,
-                    color_continuous_scale='RdBu_r',
-                    zmin=-1, zmax=1,
-                    text_auto='.4f')
+    fig = figures.correlation_heatmap(correlation_matrix_masked, shortened_labels)
 
     # Update layout for better readability
     fig.update_layout(
@@ -784,67 +435,25 @@ def create_combined_correlation_matrix_triangle_plotly(df):
         xaxis=dict(tickangle=45, tickfont=dict(size=8)),  # Reduce the font size of x-axis labels
         yaxis=dict(tickfont=dict(size=8))  # Reduce the font size of y-axis labels
     )
-    # Save the figure in different formats
-    fig.write_image(os.path.join(common.get_configs('plots'), 'combined_correlation_matrix_lower_triangle_plotly.png'),
-                    width=1600, height=900, scale=3)
-
-    # Save plot as HTML
-    pio.write_html(fig, file=os.path.join(common.get_configs('plots'),
-                                          'combined_correlation_matrix_lower_triangle_plotly.html'), auto_open=True)
+    # Queue the figure for export as PNG and HTML
+    export.save_figure(fig, 'combined_correlation_matrix_lower_triangle_plotly')
 
 
-def pre_and_on_mobile_and_pre_public(df):
+@register('pre_and_on_mobile_and_pre_public', 'co_occurrence')
+@cache.reads('Information required preboarding (mobile screen)', 'Information required preboarding (public screen)',
+             'Information required onboarding (mobile screen)')
+def pre_and_on_mobile_and_pre_public(co_occurrence):
     preboarding_mobile_column = 'Information required preboarding (mobile screen)'
     preboarding_public_column = 'Information required preboarding (public screen)'
     onboarding_mobile_column = 'Information required onboarding (mobile screen)'
 
-    columns = [
-        preboarding_mobile_column,
-        preboarding_public_column,
-        onboarding_mobile_column
-    ]
-
-    # Mapping of long column names to shorter labels
-    col_mapping = {
-        'Information required preboarding (mobile screen)': 'Pre-Mob',
-        'Information required preboarding (public screen)': 'Pre-Pub',
-        'Information required onboarding (mobile screen)': 'On-Mob'
-    }
-
-    mlb = MultiLabelBinarizer()
-
-    # Process columns
-    binary_matrices = {}
-    for col in columns:
-        column_data = df.select(col).collect().to_series()
-        options = process_options(column_data)
-        binary_matrix = pd.DataFrame(mlb.fit_transform(options), columns=[f"{col}: {opt}" for opt in mlb.classes_],
-                                     dtype=int)
-        binary_matrices[col] = binary_matrix
-
-    # Get binary matrices for specific columns
-    binary_preboarding_mobile = binary_matrices[preboarding_mobile_column]
-    binary_preboarding_public = binary_matrices[preboarding_public_column]
-    binary_onboarding_mobile = binary_matrices[onboarding_mobile_column]
-
-    # Combine the necessary matrices
-    combined_matrix = pd.concat([binary_preboarding_mobile, binary_preboarding_public, binary_onboarding_mobile],
-                                axis=1)
-    combined_matrix = combined_matrix.loc[:, ~combined_matrix.columns.duplicated()]
-
-    # Calculate pairwise correlation
-    correlation_matrix = combined_matrix.corr()
+    # Calculate the correlation of preboarding mobile with preboarding public and onboarding mobile options
+    heatmap_data = co_occurrence.corr(rows=[preboarding_mobile_column],
+                                      columns=[preboarding_public_column, onboarding_mobile_column])
 
     # Shorten the labels for better readability
-    y_labels = [shorten_label(label, col_mapping) for label in binary_preboarding_mobile.columns]
-    x_labels = [shorten_label(label, col_mapping) for label in list(binary_preboarding_public.columns)
-                + list(binary_onboarding_mobile.columns)]
-
-    # Make sure to rename the correlation matrix columns and index for proper indexing
-    correlation_matrix.columns = [shorten_label(label, col_mapping) for label in correlation_matrix.columns]
-    correlation_matrix.index = [shorten_label(label, col_mapping) for label in correlation_matrix.index]
-
-    heatmap_data = correlation_matrix.loc[y_labels, x_labels]
+    heatmap_data.index = [figures.shorten_label(label, indicators.COLUMN_LABELS) for label in heatmap_data.index]
+    heatmap_data.columns = [figures.shorten_label(label, indicators.COLUMN_LABELS) for label in heatmap_data.columns]
 
     # Create the heatmap using Plotly
     fig = go.Figure(data=go.Heatmap(
@@ -883,136 +492,168 @@ def pre_and_on_mobile_and_pre_public(df):
                 font=dict(size=10)  # Increase text size in the cell
             )
 
-    # Save the figure as an HTML file
-    fig.write_image(os.path.join(common.get_configs('plots'), 'pre_and_on_mobile_and_pre_public.png'),
-                    width=1600, height=900, scale=3)
-
-    # Save plot as HTML
-    pio.write_html(fig, file=os.path.join(common.get_configs('plots'),
-                                          'pre_and_on_mobile_and_pre_public.html'), auto_open=True)
-
-
-def new_merged_pie_plot(df):
-    # Create a 1x4 subplot figure with domain type for pie charts
-    fig = make_subplots(rows=1, cols=4,
-                        specs=[[{'type': 'domain'}, {'type': 'domain'}, {'type': 'domain'}, {'type': 'domain'}]])
-
-    # Micro-mobility usage
-    frequency_counts = df.group_by("Micro-mobillity frequency").agg(pl.count(
-        'Micro-mobillity frequency').alias('count')).collect()
-    frequency = frequency_counts['Micro-mobillity frequency'].to_list()
-    counts = frequency_counts['count'].to_list()
-    desired_order = ["Everyday", "4 to 6 days a week", "1 to 3 days a week",
-                     "Once a month to once a week", "Less than once a month", "Never"]
-    ordered_indices = [frequency.index(item) for item in desired_order if item in frequency]
-    ordered_frequency = [frequency[i] for i in ordered_indices]
-    ordered_counts = [counts[i] for i in ordered_indices]
-    fig.add_trace(go.Pie(labels=ordered_frequency, values=ordered_counts, hole=0.0, pull=[0] * len(ordered_frequency),
-                         sort=False, textinfo='label+percent', textfont=dict(size=10)), row=1, col=1)
-
-    # Bus usage
-    frequency_counts = df.group_by("Bus frequency").agg(pl.count('Bus frequency').alias('count')).collect()
-    frequency = frequency_counts['Bus frequency'].to_list()
-    counts = frequency_counts['count'].to_list()
-    desired_order = ["0 times", "1–2 times", "3–4 times", "5–6 times", "7 or more times"]
-    ordered_indices = [frequency.index(item) for item in desired_order if item in frequency]
-    ordered_frequency = [frequency[i] for i in ordered_indices]
-    ordered_counts = [counts[i] for i in ordered_indices]
-    # Append "in a week" to each label
-    ordered_frequency = [label + " in a week" for label in ordered_frequency]
-    fig.add_trace(go.Pie(labels=ordered_frequency, values=ordered_counts, hole=0.0, pull=[0] * len(ordered_frequency),
-                         sort=False, textinfo='label+percent', textfont=dict(size=10)), row=1, col=2)
-
-    # Viewing assistance necessity
-    frequency_counts = df.group_by("Assistance feature valuable?").agg(pl.count(
-        'Assistance feature valuable?').alias('count')).collect()
-    frequency = frequency_counts['Assistance feature valuable?'].to_list()
-    counts = frequency_counts['count'].to_list()
-    desired_order = ["Strongly disagree", "Disagree", "Neither disagree nor agree", "Agree", "Strongly agree"]
-    ordered_indices = [frequency.index(item) for item in desired_order if item in frequency]
-    ordered_frequency = [frequency[i] for i in ordered_indices]
-    ordered_counts = [counts[i] for i in ordered_indices]
-    fig.add_trace(go.Pie(labels=ordered_frequency, values=ordered_counts, hole=0.0, pull=[0] * len(ordered_frequency),
-                         sort=False, textinfo='label+percent', textfont=dict(size=10)), row=1, col=3)
-
-    # NFC necessity
-    frequency_counts = df.group_by("NFC feature valuable").agg(pl.count(
-        'NFC feature valuable').alias('count')).collect()
-    frequency = frequency_counts['NFC feature valuable'].to_list()
-    counts = frequency_counts['count'].to_list()
-    desired_order = ["Strongly disagree", "Disagree", "Neither disagree nor agree", "Agree", "Strongly agree"]
-    ordered_indices = [frequency.index(item) for item in desired_order if item in frequency]
-    ordered_frequency = [frequency[i] for i in ordered_indices]
-    ordered_counts = [counts[i] for i in ordered_indices]
-    fig.add_trace(go.Pie(labels=ordered_frequency, values=ordered_counts, hole=0.0, pull=[0] * len(ordered_frequency),
-                         sort=False, textinfo='label+percent', textfont=dict(size=10)), row=1, col=4)
-
-    # Update layout for the entire figure and add annotations for centered subplot titles
-    fig.update_layout(
-        showlegend=False,  # Hide the legend for all subplots
-        annotations=[
-            dict(text="Micro-Mobility Usage", x=0.065, y=0.5, xref='paper',
-                 yref='paper', showarrow=False, font=dict(size=12)),
-            dict(text="Bus Usage", x=0.375, y=0.5, xref='paper',
-                 yref='paper', showarrow=False, font=dict(size=12)),
-            dict(text="Viewing Assistance", x=0.625, y=0.5, xref='paper',
-                 yref='paper', showarrow=False, font=dict(size=12)),
-            dict(text="NFC Necessity", x=0.92, y=0.5, xref='paper',
-                 yref='paper', showarrow=False, font=dict(size=12))
-        ]
-    )
+    # Queue the figure for export as PNG and HTML
+    export.save_figure(fig, 'pre_and_on_mobile_and_pre_public')
+
+
+def register_spec_plots():
+    """
+    Register the pie charts of the single-choice questions, made from the
+    plot specifications in the config file. The config is only read here,
+    so importing this module has no side effects.
+    """
+    spec_engine = specs.Engine(common.get_configs('plot_specs'))
+    for spec_name in spec_engine.names():
+        register(spec_name, 'count_table')(spec_engine.plot_function(spec_name))
+
+
+def main(argv=None):
+    """Run the analysis with the command-line arguments argv (by default those of the program)."""
+    # JSON logs are read by machines, so they also include the timings of each stage and exported file. Logging is
+    # set up before the settings are loaded, so their warnings are logged in the chosen format
+    json_logs = common.read_entry('log_format') == 'json'
+    logs(show_level='debug' if json_logs else 'info', show_color=True, multiproc=True, queue=True,
+         json_lines=json_logs)
+    common.settings()
+    register_spec_plots()
+
+    parser = argparse.ArgumentParser(description='Analyse the shuttle bus survey responses.')
+    parser.add_argument('--only',
+                        help='comma-separated names of the plots to make, e.g. age,NFC (default: all plots)')
+    parser.add_argument('--formats', default=','.join(export.FORMATS),
+                        help='comma-separated formats to export the plots in (default: %(default)s)')
+    parser.add_argument('--force', action='store_true',
+                        help='make the plots even if their outputs are up to date')
+    parser.add_argument('--list', action='store_true',
+                        help='list the names of all plots and exit')
+    source = parser.add_mutually_exclusive_group()
+    source.add_argument('--incremental', action='store_true',
+                        help='only aggregate the responses appended to the data file since the last run')
+    source.add_argument('--shards',
+                        help='comma-separated response files or glob patterns to aggregate in parallel and merge '
+                             'instead of the data file')
+    source.add_argument('--states',
+                        help='comma-separated aggregate state files or glob patterns to merge and plot '
+                             'instead of the data file')
+    parser.add_argument('--save-state', metavar='FILE',
+                        help='save the aggregate state of the responses to FILE for merging later and exit')
+    parser.add_argument('--headless', action='store_true',
+                        help='do not open a browser at the end of the run (overrides the headless config entry)')
+    parser.add_argument('--trace', metavar='FILE',
+                        help='also write the timings of the run as a Chrome trace to FILE')
+    args = parser.parse_args(argv)
+
+    if args.list:
+        print('\n'.join(PLOTS))
+        parser.exit()
+
+    # Check the selected plots and formats
+    names = list(dict.fromkeys(args.only.split(','))) if args.only else list(PLOTS)
+    unknown = [name for name in names if name not in PLOTS]
+    if unknown:
+        parser.error('unknown plot(s): {}. Use --list to see all plots.'.format(', '.join(unknown)))
+    # Plots, e.g. from the plot specifications in the config file, must not clash with the other stages
+    clashes = [name for name in names if name in STAGES]
+    if clashes:
+        parser.error('plot(s) {} have the name of a stage of the analysis, rename them.'.format(', '.join(clashes)))
+    for name in [name for name in names if missing_packages(name)]:
+        if args.only:
+            parser.error('plot {} needs {}, which could not be found.'.format(name, ', '.join(missing_packages(name))))
+        # Plots needing an optional package that is not installed are left out of a run of all plots
+        logger.warning('Skipped {}, it needs {}, which could not be found.', name, ', '.join(missing_packages(name)))
+        names.remove(name)
+    try:
+        export.set_formats(args.formats.split(','))
+    except ValueError as e:
+        parser.error(str(e))
 
-    # Save the figure in different formats
-    fig.write_image(os.path.join(common.get_configs('plots'), 'merged_pie_plots.png'),
-                    width=1600, height=900, scale=3)
+    logger.info("Analysis started.")
 
-    # Save plot as HTML
-    fig.write_html(os.path.join(common.get_configs('plots'), 'merged_pie_plots.html'), auto_open=True)
+    # Columns of the responses read by the selected plots, by the input they take
+    columns = {}
+    for name in names:
+        func, data = PLOTS[name]
+        columns.setdefault(data, {}).update(dict.fromkeys(func.columns))
+
+    # Stages of the analysis, run lazily: only the stages needed for the selected plots are run, and stages
+    # that do not depend on each other run concurrently
+    # With a memory budget the responses are streamed and only their aggregates are held in memory
+    memory_budget_mb = common.get_configs('memory_budget_mb')
+    graph = pipeline.Pipeline()
+    if args.incremental:
+        # Update the persisted aggregates of all responses with the rows appended since the last run
+        graph.add('state', lambda: dataset.update_state(common.get_configs('data'), memory_budget_mb))
+    elif args.shards:
+        # Aggregate each response file in its own process and merge the aggregates
+        graph.add('state', lambda: dataset.aggregate_shards(dataset.resolve_paths(args.shards.split(',')),
+                                                            memory_budget_mb=memory_budget_mb))
+    elif args.states:
+        # Merge the aggregates saved by earlier runs, e.g. of other survey waves or sites
+        graph.add('state', lambda: merge_states([AggregateState.load(path)
+                                                 for path in dataset.resolve_paths(args.states.split(','))]))
+    elif args.save_state:
+        # Aggregate all columns, so the state can be merged and plotted later
+        graph.add('state', lambda: dataset.aggregate_file(common.get_configs('data'), memory_budget_mb))
+    elif memory_budget_mb is not None:
+        # Stream the needed columns of the filtered and normalized responses and aggregate them in bounded memory
+        graph.add('state', lambda: dataset.stream_state(common.get_configs('data'), memory_budget_mb,
+                                                        list(columns.get('count_table', [])),
+                                                        list(columns.get('option_table', [])),
+                                                        list(columns.get('co_occurrence', []))))
+    else:
+        # Load the needed columns of the filtered and normalized responses once and aggregate them
+        graph.add('frame', lambda: dataset.prepare_data(common.get_configs('data'),
+                                                        list({col: None for cols in columns.values() for col in cols})))
+        graph.add('category_counts', lambda df: count_categories(df, list(columns.get('count_table', []))), ['frame'])
+        graph.add('option_counts', lambda df: count_options(df, list(columns.get('option_table', []))), ['frame'])
+        graph.add('co_occurrence_counts', lambda df: count_co_occurrence(df, list(columns.get('co_occurrence', []))),
+                  ['frame'])
+        graph.add('state', lambda df, categories, options, co_occurrence: AggregateState(
+            df.height, categories, options, co_occurrence),
+            ['frame', 'category_counts', 'option_counts', 'co_occurrence_counts'])
+
+    if args.save_state:
+        state = graph.run(['state'])['state']
+        state.save(args.save_state)
+        logger.info('Saved aggregate state of {} responses to {}.', state.n, args.save_state)
+        parser.exit()
+
+    # Import the optional packages of the selected plots while the responses are aggregated, before the plots run
+    # in several threads: plotly looks pandas up in sys.modules and fails on a module another thread still imports
+    graph.add('packages', lambda: [importlib.import_module(package) for name in names for package in REQUIRES[name]])
+
+    # Inputs of the plot functions, all looked up from the aggregate state
+    graph.add('count_table', lambda state, _: state.count_table(), ['state', 'packages'])
+    graph.add('option_table', lambda state, _: state.option_table(), ['state', 'packages'])
+    graph.add('co_occurrence', lambda state, _: state.co_occurrence, ['state', 'packages'])
+
+    # The plot functions run concurrently and queue their figures for export; the ones drawing with pyplot share
+    # its global state, so they run one at a time
+    for name in names:
+        func, data = PLOTS[name]
+        graph.add(name, functools.partial(cache.run, func, force=args.force), ['state', data],
+                  serial=name in PYPLOT)
+
+    # Render the queued figures in parallel and remember the fingerprints of the exported plots
+    graph.add('export', lambda *ran: cache.commit(export.flush()), names, serial=True)
+
+    graph.run(['export'])
+    graph.report()
+
+    # Write the wall time, CPU time and peak memory of each stage, plot function and export
+    instrument.write_report()
+    if args.trace:
+        instrument.write_trace(args.trace)
+
+    # Open one index page with all figures, unless running headless
+    if args.headless or common.get_configs('headless'):
+        export.write_index()
+    else:
+        export.open_index()
+
+    logger.info("Analysis completed.")
 
 
 # Execute analysis
 if __name__ == "__main__":
-
-    # Create directory if it doesn't exist
-    output_folder = "plots"
-    os.makedirs(output_folder, exist_ok=True)
-
-    logger.info("Analysis started.")
-
-    # Read the CSV file into a Polars LazyFrame
-    dataframe = pl.scan_csv(common.get_configs('data'))
-
-    # Filter out the responses who haven't read the instruction or doesn't gave the consent
-    dataframe = dataframe.filter((pl.col("Have you read and understood the above instructions?") == "Yes")
-                                 & (pl.col("Consent to participate") == "Yes"))
-
-    # Replace all variation of Netherlands to maintain consistency
-    dataframe = dataframe.with_columns(pl.col("Country").str.replace_many(
-        ["NL", "The Netherlands", "netherlands", "Netherlands "], "Netherlands"))
-
-    # Replace all variation of Germany to maintain consistency
-    dataframe = dataframe.with_columns(pl.col("Country").str.replace_many(
-        ["Germany "], "Germany"))
-
-    # Replace all variation of India to maintain consistency
-    dataframe = dataframe.with_columns(pl.col("Country").str.replace_many(
-        ["India "], "India"))
-
-    gender_distribution_bar(dataframe)
-    gender_distribution_pie(dataframe)
-    age_distribution(dataframe)
-    demographic_distribution_bar(dataframe)
-    demographic_distribution_pie(dataframe)
-    use_micro_mobility(dataframe)
-    use_bus(dataframe)
-    viewing_assistance(dataframe)
-    NFC(dataframe)
-    info_preboarding(dataframe)
-    info_onboarding(dataframe)
-    create_combined_correlation_matrix(dataframe)
-    create_combined_correlation_matrix_triangle(dataframe)
-    create_combined_correlation_matrix_triangle_plotly(dataframe)
-    pre_and_on_mobile_and_pre_public(dataframe)
-    new_merged_pie_plot(dataframe)
-
-    logger.info("Analysis completed.")
+    main()
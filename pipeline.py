@@ -0,0 +1,137 @@
+"""Contains a small executor that runs the analysis as a graph of stages."""
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import instrument
+from custom_logger import CustomLogger
+
+logger = CustomLogger(__name__)  # use custom logger
+
+
+class Stage:
+    """A stage of a pipeline: a function that is called with the results of the stages it depends on."""
+
+    def __init__(self, name, func, inputs, serial):
+        self.name = name
+        self.func = func
+        self.inputs = list(inputs)
+        self.serial = serial
+
+
+class Pipeline:
+    """Graph of stages that is evaluated lazily.
+
+    Only the stages needed for the requested targets are run, each of them
+    once, so intermediates shared by several stages are computed once.
+    Stages whose inputs are ready run concurrently in a thread pool; polars,
+    numpy and the BLAS routines release the GIL for the heavy work. Stages
+    added with serial=True use global state (e.g. pyplot) and are run one at
+    a time in the calling thread, in the order they were added, while the
+    pool keeps working on the other stages.
+    """
+
+    def __init__(self):
+        self.stages = {}
+        self.timings = {}
+        self.serial_order = []
+        self.wall_time = 0.0
+
+    def add(self, name, func, inputs=(), serial=False):
+        """Add stage name, which calls func with the results of the stages in inputs."""
+        if name in self.stages:
+            raise ValueError('Stage {} is defined twice.'.format(name))
+        unknown = [dep for dep in inputs if dep not in self.stages]
+        if unknown:
+            raise ValueError('Stage {} depends on unknown stage(s) {}.'.format(name, ', '.join(unknown)))
+        self.stages[name] = Stage(name, func, inputs, serial)
+
+    def needed(self, targets):
+        """Return the names of the stages needed to compute targets, in the order they were added."""
+        needed = set()
+        todo = list(targets)
+        while todo:
+            name = todo.pop()
+            if name not in needed:
+                needed.add(name)
+                todo.extend(self.stages[name].inputs)
+        return [name for name in self.stages if name in needed]
+
+    def _call(self, stage, results, start):
+        """Call the function of stage with its inputs and record when it ran."""
+        begin = time.perf_counter()
+        with instrument.measure(stage.name, 'stage'):
+            result = stage.func(*[results[dep] for dep in stage.inputs])
+        self.timings[stage.name] = (begin - start, time.perf_counter() - start)
+        elapsed_ms = (time.perf_counter() - begin) * 1000
+        logger.debug('Stage {} finished in {:.1f} ms.', stage.name, elapsed_ms,
+                     extra={'stage': stage.name, 'elapsed_ms': elapsed_ms})
+        return result
+
+    def run(self, targets=None, workers=None):
+        """
+        Run the stages needed for targets (by default all stages) with at most
+        workers threads and return a dict with the result of each stage that
+        was run. An exception in a stage is raised after the running stages
+        finished.
+        """
+        waiting = self.needed(targets if targets is not None else list(self.stages))
+        results = {}
+        running = {}
+        self.timings = {}
+        self.serial_order = []
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            while waiting or running:
+                ready = [name for name in waiting if all(dep in results for dep in self.stages[name].inputs)]
+                for name in ready:
+                    if not self.stages[name].serial:
+                        running[pool.submit(self._call, self.stages[name], results, start)] = name
+                        waiting.remove(name)
+                serial = [name for name in ready if self.stages[name].serial]
+                if serial:
+                    # Run one serial stage here and look for newly ready stages afterwards
+                    waiting.remove(serial[0])
+                    self.serial_order.append(serial[0])
+                    results[serial[0]] = self._call(self.stages[serial[0]], results, start)
+                    done = [future for future in running if future.done()]
+                elif running:
+                    done, _ = wait(running, return_when=FIRST_COMPLETED)
+                else:
+                    raise ValueError('Stages {} cannot run.'.format(', '.join(waiting)))
+                for future in done:
+                    results[running.pop(future)] = future.result()
+        self.wall_time = time.perf_counter() - start
+        return results
+
+    def critical_path(self):
+        """
+        Return the names of the stages on the critical path of the last run,
+        the chain of dependent stages with the longest total duration, and
+        that duration in seconds. A serial stage also depends on the serial
+        stage that ran before it, as it had to wait for it.
+        """
+        length = {}
+        previous = {}
+        waited = dict(zip(self.serial_order[1:], self.serial_order))
+        for name in sorted(self.timings, key=lambda name: self.timings[name][1]):
+            inputs = [dep for dep in self.stages[name].inputs + [waited.get(name)] if dep in length]
+            previous[name] = max(inputs, key=length.get) if inputs else None
+            begin, end = self.timings[name]
+            length[name] = (end - begin) + (length[previous[name]] if previous[name] else 0)
+        if not length:
+            return [], 0.0
+        name = max(length, key=length.get)
+        total = length[name]
+        path = []
+        while name is not None:
+            path.append(name)
+            name = previous[name]
+        return path[::-1], total
+
+    def report(self):
+        """Log the duration and the critical path of the last run."""
+        path, total = self.critical_path()
+        logger.info('Ran {} stages in {:.2f} s. Critical path ({:.2f} s): {}.', len(self.timings), self.wall_time,
+                    total, ' -> '.join('{} ({:.2f} s)'.format(name, self.timings[name][1] - self.timings[name][0])
+                                       for name in path),
+                    extra={'stage': 'pipeline', 'elapsed_ms': self.wall_time * 1000, 'critical_path': path,
+                           'critical_path_ms': total * 1000})
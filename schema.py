@@ -0,0 +1,44 @@
+"""Contains the answer levels of the ordinal survey questions and their ordered polars Enum types."""
+import polars as pl
+
+# Answers of the frequency questions, from the most to the least frequent use
+MICRO_MOBILITY_LEVELS = ['Everyday', '4 to 6 days a week', '1 to 3 days a week', 'Once a month to once a week',
+                         'Less than once a month', 'Never']
+BUS_LEVELS = ['0 times', '1–2 times', '3–4 times', '5–6 times', '7 or more times']
+
+# Answers of the Likert questions, from disagreement to agreement
+LIKERT_LEVELS = ['Strongly disagree', 'Disagree', 'Neither disagree nor agree', 'Agree', 'Strongly agree']
+
+# Ordinal columns with their answers in the order they are plotted
+ORDINAL_COLUMNS = {
+    'Micro-mobillity frequency': MICRO_MOBILITY_LEVELS,
+    'Bus frequency': BUS_LEVELS,
+    'Assistance feature valuable?': LIKERT_LEVELS,
+    'NFC feature valuable': LIKERT_LEVELS
+}
+
+
+def levels(column):
+    """Return the answers of the ordinal column in their order, or None if column is not ordinal."""
+    return ORDINAL_COLUMNS.get(column)
+
+
+def enum(column):
+    """Return the ordered Enum type of the ordinal column."""
+    return pl.Enum(ORDINAL_COLUMNS[column])
+
+
+def rank(column):
+    """Return a dict with the position of each answer of the ordinal column, to sort answers without list searches."""
+    return {level: i for i, level in enumerate(ORDINAL_COLUMNS[column])}
+
+
+def cast(lf):
+    """
+    Cast the ordinal columns of the LazyFrame lf to their Enum types. The
+    answers are stored dictionary-encoded and sort in their order. An answer
+    that is not a level of its question makes the query fail when it is
+    collected, with a polars ComputeError naming the column and the answers,
+    instead of being left out of the plots.
+    """
+    return lf.with_columns(pl.col(col).cast(enum(col)) for col in ORDINAL_COLUMNS)
@@ -0,0 +1,143 @@
+"""Contains the declarative specifications of the pie charts and the engine that makes them."""
+import plotly.graph_objects as go
+from plotly.subplots import make_subplots
+import aggregate
+import cache
+import export
+import schema
+from custom_logger import CustomLogger
+
+logger = CustomLogger(__name__)  # use custom logger
+
+# Chart types of the specifications. A pie shows the categories in the
+# given order, a likert_pie also shows categories without responses and the
+# percentages with two decimals, and a pie_row shows the pies of other
+# specifications next to each other.
+CHART_TYPES = ('pie', 'likert_pie', 'pie_row')
+
+
+def validate(specs):
+    """
+    Check the list of specifications specs. Raises ValueError if a name is
+    used twice, a chart type is unknown, an entry is missing or a pie_row
+    refers to a specification that does not exist or is itself a pie_row.
+    The order may be left out for the ordinal columns of the schema.
+    """
+    by_name = {}
+    for spec in specs:
+        if 'name' not in spec or spec.get('chart') not in CHART_TYPES:
+            raise ValueError('Plot specification {} needs a name and a chart out of {}.'.format(
+                spec, ', '.join(CHART_TYPES)))
+        if spec['name'] in by_name:
+            raise ValueError('Plot specification {} is defined twice.'.format(spec['name']))
+        required = ['panels'] if spec['chart'] == 'pie_row' else ['column', 'order', 'title']
+        missing = [key for key in required if key not in spec
+                   and not (key == 'order' and schema.levels(spec.get('column')) is not None)]
+        if missing:
+            raise ValueError('Plot specification {} misses {}.'.format(spec['name'], ', '.join(missing)))
+        by_name[spec['name']] = spec
+    for spec in specs:
+        for panel in spec.get('panels', []):
+            target = by_name.get(panel.get('plot'))
+            if target is None or target['chart'] == 'pie_row':
+                raise ValueError('Panel {} of plot specification {} does not refer to a pie.'.format(
+                    panel.get('plot'), spec['name']))
+
+
+class Engine:
+    """
+    Makes the figures of a list of plot specifications. The counts of a
+    column are looked up once per count table and shared by all
+    specifications that read the column, including the panels of a pie_row.
+    """
+
+    def __init__(self, specs):
+        validate(specs)
+        self.specs = {spec['name']: spec for spec in specs}
+        self._table = None
+        self._counts = {}
+
+    def names(self):
+        """Return the names of the specifications in the order they are defined."""
+        return list(self.specs)
+
+    def columns(self, name):
+        """Return the columns read by specification name."""
+        spec = self.specs[name]
+        if spec['chart'] == 'pie_row':
+            return list(dict.fromkeys(self.specs[panel['plot']]['column'] for panel in spec['panels']))
+        return [spec['column']]
+
+    def counts(self, count_table, column):
+        """Return a dict with the count of each value of column in count_table, computed once per column."""
+        if count_table is not self._table:
+            self._table = count_table
+            self._counts = {}
+        if column not in self._counts:
+            self._counts[column] = dict(zip(*aggregate.get_counts(count_table, column)))
+        return self._counts[column]
+
+    def ordered_counts(self, count_table, spec, keep_empty=False):
+        """
+        Return the categories of spec in its order (by default the order of the
+        answers in the schema) and their counts. Categories without responses
+        are left out, unless keep_empty is True.
+        """
+        counts = self.counts(count_table, spec['column'])
+        order = spec.get('order', schema.levels(spec['column']))
+        labels = [item for item in order if keep_empty or item in counts]
+        return labels, [counts.get(item, 0) for item in labels]
+
+    def figure(self, name, count_table):
+        """Return the figure of specification name made from count_table."""
+        spec = self.specs[name]
+        if spec['chart'] == 'pie_row':
+            return self._pie_row(spec, count_table)
+        likert = spec['chart'] == 'likert_pie'
+        labels, counts = self.ordered_counts(count_table, spec, keep_empty=likert)
+        if likert:
+            pie = go.Pie(labels=labels, values=counts, hole=0.0, pull=[0] * len(labels), sort=False,
+                         textinfo='percent', insidetextorientation='horizontal', hoverinfo='label+percent')
+        else:
+            pie = go.Pie(labels=labels, values=counts, hole=0.0, pull=[0] * len(labels), sort=False)
+        fig = go.Figure(data=[pie])
+        fig.update_layout(
+            legend_title_text=spec['title'],
+            legend=dict(itemsizing='constant', font=dict(size=12))
+        )
+        if likert:
+            # Hide the labels of categories without responses
+            fig.update_traces(texttemplate=[f'{c / sum(counts) * 100:.2f}%' if c > 0 else '' for c in counts])
+        return fig
+
+    def _pie_row(self, spec, count_table):
+        """Return a figure with the pies of the panels of spec next to each other, without legend."""
+        panels = spec['panels']
+        fig = make_subplots(rows=1, cols=len(panels), specs=[[{'type': 'domain'}] * len(panels)])
+        annotations = []
+        for i, panel in enumerate(panels):
+            labels, counts = self.ordered_counts(count_table, self.specs[panel['plot']])
+            labels = [label + panel.get('label_suffix', '') for label in labels]
+            fig.add_trace(go.Pie(labels=labels, values=counts, hole=0.0, pull=[0] * len(labels), sort=False,
+                                 textinfo='label+percent', textfont=dict(size=10)), row=1, col=i + 1)
+            # Centre the title of the panel in its pie, unless a position is given
+            domain = fig.data[-1].domain.x
+            annotations.append(dict(text=panel['title'], x=panel.get('x', (domain[0] + domain[1]) / 2), y=0.5,
+                                    xref='paper', yref='paper', showarrow=False, font=dict(size=12)))
+        fig.update_layout(showlegend=False, annotations=annotations)
+        return fig
+
+    def plot_function(self, name):
+        """
+        Return a plot function for specification name, which takes the count
+        table and queues the figure for export. The function records the
+        columns it reads and its specification, including the specifications
+        of its panels, for the fingerprint of the figure cache.
+        """
+        @cache.reads(*self.columns(name))
+        def plot(count_table):
+            export.save_figure(self.figure(name, count_table), name)
+
+        plot.__name__ = name
+        plot.spec = [self.specs[name]] + [self.specs[panel['plot']] for panel in self.specs[name].get('panels', [])]
+        return plot
@@ -0,0 +1,183 @@
+"""Contains the mergeable aggregate state of the survey responses."""
+import json
+import hashlib
+import numpy as np
+import polars as pl
+import aggregate
+import correlation
+import indicators
+import instrument
+import schema
+
+
+def _sort_key(value):
+    """Sort key that puts missing values last."""
+    return (value is None, value)
+
+
+@instrument.timed('aggregation')
+def count_categories(df, columns):
+    """Return the count of each value of the categorical columns in df, by column."""
+    if not columns:
+        return {}
+    return {col: dict(zip(counts[col].to_list(), counts['count'].to_list()))
+            for col, counts in aggregate.count_values(df, columns).items()}
+
+
+@instrument.timed('aggregation')
+def count_options(df, columns):
+    """Return the count of each option of the multi-select columns in df, by column."""
+    return {col: aggregate.process_column(df.get_column(col))[1] for col in columns}
+
+
+def count_co_occurrence(df, columns):
+    """Return the co-occurrence counts of the options of the information columns in df, or None without columns."""
+    if not columns:
+        return None
+    return indicators.encode_options(df, columns).co_occurrence()
+
+
+class AggregateState:
+    """Aggregates of the survey responses that all plots are made from.
+
+    Holds the number of responses n, the value counts of the categorical
+    columns, the option counts of the multi-select columns and the
+    co-occurrence counts of the information indicators. All parts are sums
+    over responses, so the states of disjoint sets of responses can be
+    merged into the state of all of them.
+    """
+
+    def __init__(self, n=0, categories=None, options=None, co_occurrence=None):
+        self.n = n
+        self.categories = categories if categories is not None else {}
+        self.options = options if options is not None else {}
+        self.co_occurrence = co_occurrence
+
+    @classmethod
+    def from_frame(cls, df, categorical_columns=None, option_columns=None, indicator_columns=None):
+        """
+        Compute the aggregate state of the responses in df. By default all
+        categorical and information columns are aggregated; pass lists of
+        columns to only aggregate these.
+        """
+        if categorical_columns is None:
+            categorical_columns = aggregate.CATEGORICAL_COLUMNS
+        if option_columns is None:
+            option_columns = indicators.INFORMATION_COLUMNS
+        if indicator_columns is None:
+            indicator_columns = indicators.INFORMATION_COLUMNS
+        return cls(df.height, count_categories(df, categorical_columns), count_options(df, option_columns),
+                   count_co_occurrence(df, indicator_columns))
+
+    def columns(self):
+        """Return the set of columns aggregated in the state."""
+        columns = set(self.categories) | set(self.options)
+        if self.co_occurrence is not None:
+            columns |= set(self.co_occurrence.options)
+        return columns
+
+    def merge(self, other):
+        """
+        Return the state of the responses of this state and of the disjoint
+        state other. Both states must aggregate the same columns, unless one
+        of them is empty.
+        """
+        if self.n and other.n and self.columns() != other.columns():
+            raise ValueError('Cannot merge states of different columns: {} and {}.'.format(
+                sorted(self.columns()), sorted(other.columns())))
+        categories = {col: dict(counts) for col, counts in self.categories.items()}
+        for col, counts in other.categories.items():
+            merged = categories.setdefault(col, {})
+            for value, count in counts.items():
+                merged[value] = merged.get(value, 0) + count
+        options = {col: dict(counts) for col, counts in self.options.items()}
+        for col, counts in other.options.items():
+            merged = options.setdefault(col, {})
+            for option, count in counts.items():
+                merged[option] = merged.get(option, 0) + count
+        if self.co_occurrence is None or other.co_occurrence is None:
+            co_occurrence = self.co_occurrence if other.co_occurrence is None else other.co_occurrence
+        else:
+            co_occurrence = self.co_occurrence.merge(other.co_occurrence)
+        return AggregateState(self.n + other.n, categories, options, co_occurrence)
+
+    def count_table(self):
+        """
+        Return the value counts of the categorical columns as a count table
+        (see aggregate.count_values), sorted by value. The answers of the
+        ordinal columns are sorted in their order.
+        """
+        count_table = {}
+        for col, counts in self.categories.items():
+            if schema.levels(col) is None:
+                values = sorted(counts, key=_sort_key)
+            else:
+                position = schema.rank(col)
+                values = sorted(counts, key=lambda value: (value not in position, position.get(value, 0)))
+            count_table[col] = pl.DataFrame({col: values, 'count': [counts[value] for value in values]})
+        return count_table
+
+    def option_table(self):
+        """
+        Return the percentage of participants choosing each option and the
+        counts of each option of the multi-select columns, as returned by
+        aggregate.process_column, by column.
+        """
+        return {col: ({option: (count / self.n) * 100 for option, count in counts.items()}, counts)
+                for col, counts in self.options.items()}
+
+    def digest(self, columns):
+        """Return a hash of the parts of the state that depend on the given columns."""
+        h = hashlib.sha256()
+        h.update(str(self.n).encode())
+        for col in columns:
+            if col in self.categories:
+                h.update(repr(sorted(self.categories[col].items(), key=lambda item: _sort_key(item[0]))).encode())
+            if col in self.options:
+                h.update(repr(sorted(self.options[col].items())).encode())
+        if self.co_occurrence is not None:
+            selected = [col for col in columns if col in self.co_occurrence.options]
+            if selected:
+                part = self.co_occurrence.select(selected)
+                h.update(repr(part.options).encode())
+                h.update(np.ascontiguousarray(part.counts).tobytes())
+        return h.hexdigest()
+
+    def to_dict(self):
+        """Return the state as a JSON-serializable dictionary."""
+        return {
+            'n': self.n,
+            'categories': {col: sorted(([value, count] for value, count in counts.items()),
+                                       key=lambda item: _sort_key(item[0]))
+                           for col, counts in self.categories.items()},
+            'options': {col: dict(sorted(counts.items())) for col, counts in self.options.items()},
+            'co_occurrence': None if self.co_occurrence is None else self.co_occurrence.to_dict()
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        """Create a state from a dictionary made by to_dict."""
+        categories = {col: {value: count for value, count in counts} for col, counts in data['categories'].items()}
+        co_occurrence = None
+        if data['co_occurrence'] is not None:
+            co_occurrence = correlation.CoOccurrence.from_dict(data['co_occurrence'])
+        return cls(data['n'], categories, data['options'], co_occurrence)
+
+    def save(self, path):
+        """Save the state as JSON file."""
+        with open(path, 'w') as f:
+            json.dump(self.to_dict(), f)
+
+    @classmethod
+    def load(cls, path):
+        """Load a state from a JSON file made by save."""
+        with open(path) as f:
+            return cls.from_dict(json.load(f))
+
+
+def merge_states(states):
+    """Return the merged state of a list of states of disjoint sets of responses."""
+    merged = AggregateState()
+    for part in states:
+        merged = merged.merge(part)
+    return merged
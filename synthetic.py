@@ -0,0 +1,99 @@
+"""Contains a generator of synthetic survey responses with the schema of the real responses."""
+import argparse
+import itertools
+import numpy as np
+import polars as pl
+import aggregate
+import indicators
+import schema
+from custom_logger import CustomLogger
+
+logger = CustomLogger(__name__)  # use custom logger
+
+# Answers of the single-choice questions
+GENDERS = ['Male', 'Female']
+COUNTRIES = ['Netherlands', 'NL', 'The Netherlands', 'netherlands', 'Netherlands ', 'Germany', 'Germany ', 'India',
+             'India ', 'Japan', 'USA', 'China', 'Italy']
+
+# Options of the multi-select information questions
+PREBOARDING_OPTIONS = ['Accessibility routes', 'Announcements', 'Departure countdown', 'E-ticket/boarding pass',
+                       'Local map', 'Real-time traffic updates', 'Route details to the shuttle bus stop',
+                       'Safety guidelines', 'Shuttle bus location tracking', 'Shuttle bus schedule']
+ONBOARDING_OPTIONS = ['Accessibility information', 'Language translator', 'Messages and notifications',
+                      'Mobile ticketing', 'Next stop information', 'Personalised recommendations',
+                      'Public transportation connections', 'Route information',
+                      'Safety information and protocols and emergency call option', 'Weather updates']
+
+# Most options a participant picks in a multi-select question
+MAX_OPTIONS = 4
+
+# Share of responses without consent or without reading the instructions, and of skipped multi-select questions
+DROP_RATE = 0.05
+SKIP_RATE = 0.02
+
+# Columns of the response file in the order of the survey export
+COLUMNS = ['Timestamp', 'Have you read and understood the above instructions?', 'Consent to participate',
+           'Gender', 'Age'] + aggregate.CATEGORICAL_COLUMNS[2:] + indicators.INFORMATION_COLUMNS
+
+
+def _selections(options):
+    """Return every selection of 1 to MAX_OPTIONS options as the comma-separated text of the survey export."""
+    return [', '.join(combination) for k in range(1, MAX_OPTIONS + 1)
+            for combination in itertools.combinations(options, k)]
+
+
+def generate(n, seed=0):
+    """
+    Return a DataFrame with n synthetic responses with the columns of the real
+    response file. Answers are drawn uniformly; a few responses lack consent
+    or did not read the instructions, country names vary like in the real
+    responses and a few multi-select questions are skipped. The same seed
+    gives the same responses.
+    """
+    rng = np.random.default_rng(seed)
+
+    def choice(values, p=None):
+        # draw codes with numpy and look the answers up with polars, which avoids a Python string per row
+        return pl.Series(values).gather(rng.choice(len(values), size=n, p=p))
+
+    start = int(np.datetime64('2024-05-01T00:00:00', 's').astype(np.int64))
+    seconds = pl.Series(rng.integers(start, start + 60 * 60 * 24 * 60, n))
+    data = {
+        'Timestamp': pl.from_epoch(seconds, time_unit='s').dt.to_string('%Y-%m-%d %H:%M:%S'),
+        'Have you read and understood the above instructions?': choice(['Yes', 'No'], p=[1 - DROP_RATE, DROP_RATE]),
+        'Consent to participate': choice(['Yes', 'No'], p=[1 - DROP_RATE, DROP_RATE]),
+        'Gender': choice(GENDERS),
+        'Age': pl.Series(rng.integers(18, 70, n)),
+        'Country': choice(COUNTRIES),
+    }
+    # the ordinal questions are answered with the levels of the schema
+    data.update({col: choice(levels) for col, levels in schema.ORDINAL_COLUMNS.items()})
+    for col in indicators.INFORMATION_COLUMNS:
+        answers = choice(_selections(PREBOARDING_OPTIONS if 'preboarding' in col else ONBOARDING_OPTIONS))
+        data[col] = answers.zip_with(pl.Series(rng.random(n) >= SKIP_RATE), pl.Series([None], dtype=pl.Utf8))
+    return pl.DataFrame(data).select(COLUMNS)
+
+
+def write(path, n, seed=0, chunk_size=1_000_000):
+    """
+    Write n synthetic responses to the CSV file path. The responses are
+    generated in chunks of chunk_size rows, so millions of responses can be
+    written with little memory.
+    """
+    with open(path, 'wb') as f:
+        for i, start in enumerate(range(0, n, chunk_size)):
+            # derive the seed of each chunk, so chunks differ but the file is reproducible
+            generate(min(chunk_size, n - start), seed=[seed, i]).write_csv(f, include_header=(i == 0))
+    logger.info('Wrote {} synthetic responses to {}.', n, path)
+    return path
+
+
+if __name__ == "__main__":
+    from logmod import logs
+    logs(show_level='info', show_color=True)
+    parser = argparse.ArgumentParser(description='Write synthetic shuttle bus survey responses.')
+    parser.add_argument('rows', type=int, help='number of responses, e.g. 1000 or 10000000')
+    parser.add_argument('path', help='CSV file to write the responses to')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the random generator (default: %(default)s)')
+    args = parser.parse_args()
+    write(args.path, args.rows, seed=args.seed)
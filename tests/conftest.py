@@ -0,0 +1,5 @@
+"""Contains the pytest configuration that makes the modules of the project importable by the tests."""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
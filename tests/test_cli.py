@@ -0,0 +1,24 @@
+"""Contains checks of the command-line options of the analysis."""
+import logging
+import pytest
+import logmod
+import main
+
+
+@pytest.fixture
+def restore_logging():
+    """Restore the logging setup changed by main, whose handlers write to the output captured by pytest."""
+    root = logging.getLogger()
+    handlers, level = list(root.handlers), root.level
+    yield
+    logmod._stop_listener()
+    root.handlers[:] = handlers
+    root.setLevel(level)
+
+
+def test_plot_named_like_a_stage_is_rejected(monkeypatch, capsys, restore_logging):
+    monkeypatch.setitem(main.PLOTS, 'state', main.PLOTS['age'])
+    with pytest.raises(SystemExit) as exit_info:
+        main.main(['--only', 'state', '--headless'])
+    assert exit_info.value.code == 2
+    assert 'name of a stage' in capsys.readouterr().err
@@ -0,0 +1,186 @@
+"""Contains checks that the optimized aggregation gives the same results as the straightforward computation."""
+import os
+import time
+import numpy as np
+import polars as pl
+import pytest
+import aggregate
+import common
+import dataset
+import indicators
+import instrument
+import schema
+import synthetic
+from pipeline import Pipeline
+from state import AggregateState, merge_states
+
+
+@pytest.fixture
+def responses():
+    """Synthetic responses, filtered and normalized."""
+    return dataset.clean(synthetic.generate(2000, seed=1).lazy()).collect()
+
+
+def process_column_loop(data):
+    """The row loop that process_column replaced."""
+    option_counts = {}
+    for row in data:
+        options = [option.strip().lower() for option in row.split(',')]
+        for option in options:
+            option_counts[option] = option_counts.get(option, 0) + 1
+    total_participants = len(data)
+    option_percentages = {option: (count / total_participants) * 100 for option, count in option_counts.items()}
+    return option_percentages, option_counts
+
+
+def process_options_map_elements(series):
+    """The map_elements version that process_options replaced."""
+    options_list = series.map_elements(lambda x: [opt.strip().lower().capitalize() for opt in x.split(",")],
+                                       return_dtype=pl.List(pl.Utf8)).to_list()
+    return [[aggregate.OPTION_MAPPING.get(opt, opt).capitalize() for opt in sublist] for sublist in options_list]
+
+
+def option_columns():
+    """Multi-select columns of synthetic responses and a column with the special cases of the parsing."""
+    df = synthetic.generate(2000, seed=9)
+    special = pl.Series('special', [' Local map ,ANNOUNCEMENTS', 'local MAP',
+                                    'Safety information and protocols and emergency call option, Weather updates',
+                                    'Weather updates,,', ',', 'Mobile ticketing'])
+    # the original functions fail on skipped questions
+    return [df.get_column(col).drop_nulls() for col in indicators.INFORMATION_COLUMNS] + [special]
+
+
+@pytest.mark.parametrize('series', option_columns(), ids=lambda series: series.name)
+def test_option_parsing_matches_original(series):
+    assert aggregate.process_column(series) == process_column_loop(series)
+    assert aggregate.process_options(series).to_list() == process_options_map_elements(series)
+
+
+def test_phi_matches_pandas(responses):
+    pd = pytest.importorskip('pandas')
+    matrix = indicators.encode_options(responses)
+    expected = pd.DataFrame(matrix.values, columns=matrix.labels).corr()
+    corr = matrix.co_occurrence().corr()
+    assert corr.index == matrix.labels
+    np.testing.assert_allclose(corr.values, expected.values, atol=1e-12)
+    # a block is computed without the full matrix
+    rows, columns = indicators.INFORMATION_COLUMNS[:1], indicators.INFORMATION_COLUMNS[2:]
+    block = matrix.co_occurrence().corr(rows, columns)
+    np.testing.assert_allclose(block.values, expected.loc[block.index, block.columns].values, atol=1e-12)
+
+
+def test_merge_equals_state_of_all_responses(responses):
+    parts = [AggregateState.from_frame(responses.slice(start, 500)) for start in range(0, responses.height, 500)]
+    assert merge_states(parts).to_dict() == AggregateState.from_frame(responses).to_dict()
+
+
+def test_to_dict_round_trip(responses, tmp_path):
+    state = AggregateState.from_frame(responses)
+    assert AggregateState.from_dict(state.to_dict()).to_dict() == state.to_dict()
+    state.save(tmp_path / 'state.json')
+    assert AggregateState.load(tmp_path / 'state.json').to_dict() == state.to_dict()
+
+
+def test_incremental_equals_full_aggregation(tmp_path, monkeypatch):
+    monkeypatch.setattr(common, 'cache_dir', str(tmp_path / '_cache'))
+    path = str(tmp_path / 'responses.csv')
+    synthetic.generate(1500, seed=2).write_csv(path)
+    dataset.update_state(path)
+    with open(path, 'ab') as f:
+        synthetic.generate(700, seed=3).write_csv(f, include_header=False)
+    assert dataset.update_state(path).to_dict() == dataset.aggregate_file(path).to_dict()
+
+
+def test_incremental_detects_edited_rows(tmp_path, monkeypatch):
+    monkeypatch.setattr(common, 'cache_dir', str(tmp_path / '_cache'))
+    path = tmp_path / 'responses.csv'
+    # more than a MiB, so the edit is not close to the end of the file
+    synthetic.generate(8000, seed=2).write_csv(path)
+    dataset.update_state(str(path))
+    # an edit that keeps the size of the file
+    path.write_text(path.read_text().replace(',Male,', ',Mala,', 1))
+    assert dataset.update_state(str(path)).to_dict() == dataset.aggregate_file(str(path)).to_dict()
+
+
+def test_shards_equal_aggregation_of_all_files(tmp_path):
+    for i in range(2):
+        synthetic.generate(1000, seed=[8, i]).write_csv(tmp_path / 'wave{}.csv'.format(i))
+    paths = dataset.resolve_paths(str(tmp_path / '*.csv'))
+    first = len(instrument.records())
+    state = dataset.aggregate_shards(paths, workers=2)
+    assert state.to_dict() == dataset.aggregate_file(paths).to_dict()
+    # the timing records of the worker processes are added to the records of this process
+    assert any(record['pid'] != os.getpid() for record in instrument.records()[first:])
+
+
+def test_unknown_answer_is_rejected():
+    df = synthetic.generate(50, seed=4).with_columns(
+        pl.lit('Yes').alias('Have you read and understood the above instructions?'),
+        pl.lit('Yes').alias('Consent to participate'))
+    column = next(iter(schema.ORDINAL_COLUMNS))
+    df = df.with_columns(pl.when(pl.int_range(pl.len()) == 0).then(pl.lit('Sometimes')).otherwise(pl.col(column))
+                         .alias(column))
+    with pytest.raises(pl.exceptions.ComputeError):
+        dataset.clean(df.lazy()).collect()
+
+
+def test_pipeline_runs_stages_after_their_inputs():
+    order = []
+
+    def stage(name, value):
+        def func(*inputs):
+            order.append(name)
+            return value + sum(inputs)
+        return func
+
+    pipeline = Pipeline()
+    pipeline.add('a', stage('a', 1))
+    pipeline.add('b', stage('b', 10), ['a'])
+    pipeline.add('c', stage('c', 100), ['a'], serial=True)
+    pipeline.add('d', stage('d', 1000), ['b', 'c'], serial=True)
+    pipeline.add('unused', stage('unused', 0))
+    results = pipeline.run(['d'], workers=2)
+    assert results == {'a': 1, 'b': 11, 'c': 101, 'd': 1112}
+    assert order[0] == 'a' and order[-1] == 'd'
+    assert 'unused' not in order
+
+
+def test_pipeline_errors():
+    pipeline = Pipeline()
+    pipeline.add('a', lambda: 1)
+    with pytest.raises(ValueError, match='defined twice'):
+        pipeline.add('a', lambda: 2)
+    with pytest.raises(ValueError, match='unknown stage'):
+        pipeline.add('b', lambda x: x, ['missing'])
+
+    def fail(_):
+        raise RuntimeError('stage failed')
+
+    pipeline.add('c', fail, ['a'])
+    with pytest.raises(RuntimeError, match='stage failed'):
+        pipeline.run()
+
+
+def test_streaming_equals_in_memory_aggregation(tmp_path):
+    path = str(tmp_path / 'responses.csv')
+    synthetic.write(path, 5000, seed=5, chunk_size=2000)
+    # a small budget makes several batches of the co-occurrence counts
+    assert dataset.stream_state(path, 1).to_dict() == dataset.aggregate_file(path).to_dict()
+
+
+def test_streaming_files_with_different_columns(tmp_path):
+    synthetic.generate(3000, seed=6).write_csv(tmp_path / 'site1.csv')
+    synthetic.generate(2000, seed=7).drop(indicators.INFORMATION_COLUMNS[-1], 'Bus frequency').write_csv(
+        tmp_path / 'site2.csv')
+    data = str(tmp_path / '*.csv')
+    assert dataset.stream_state(data, 1).to_dict() == dataset.aggregate_file(data).to_dict()
+
+
+def test_critical_path_includes_the_wait_for_serial_stages():
+    pipeline = Pipeline()
+    pipeline.add('a', lambda: time.sleep(0.05), serial=True)
+    pipeline.add('b', lambda: time.sleep(0.05), serial=True)
+    pipeline.run()
+    path, total = pipeline.critical_path()
+    assert path == ['a', 'b']
+    assert total >= 0.1
@@ -0,0 +1,13 @@
+"""Contains checks that the main modules start quickly and leave the heavy packages to the stages needing them."""
+import pytest
+import benchmark
+
+# Most seconds an import of a main module may take; polars and numpy alone take a few tenths of a second
+IMPORT_BUDGET = 2.0
+
+
+@pytest.mark.parametrize('module', benchmark.IMPORT_MODULES)
+def test_import_is_lazy(module):
+    seconds, packages = benchmark.import_time(module)
+    assert not packages, 'Importing {} also imports {}.'.format(module, ', '.join(packages))
+    assert seconds < IMPORT_BUDGET